@@ -0,0 +1,214 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import netlog
+import network_3
+import event_sim
+import convergence
+import topology
+import tracing
+
+# End-to-end scaling benchmark: generates synthetic topologies, runs each
+# through the network_3/link_3 stack on the discrete-event simulator and
+# writes the measurements as JSON so runs can be compared between releases.
+#
+#   python benchmark.py --kinds line grid fat-tree --sizes 16 256 -o bench.json
+#
+# Timings are wall clock seconds of the simulation itself; virtual times,
+# the latency histograms among them, come from the simulator clock. The
+# event log is switched off while a case runs.
+
+
+# the number of links a packet from host src crosses to reach host dst
+# @param peer_D: node at the other end of every interface {(node, intf): node}
+# @return hop count, None if there is no route
+def count_hops(topo, peer_D, src, dst):
+    node = peer_D[(topo.host_D[src], 0)]
+    hops = 1
+    while node is not topo.host_D[dst]:
+        intf = node.next_hop(dst)
+        if intf is None or hops > len(topo.router_D):
+            return None  # no route or a forwarding loop
+        node = peer_D[(node, intf)]
+        hops += 1
+    return hops
+
+
+# build a topology and run its control plane to convergence
+# @param link_kw: link properties, see topology.build
+# @param repair_rounds: periodic full updates to wait at most for control
+#                       packets lost on the way to be made good
+# @return (Topology, Simulator, ConvergenceMonitor, result dict)
+def converge(spec, routing_S, seed, link_kw=None, repair_rounds=10):
+    result = {}
+    start = time.perf_counter()
+    topo = topology.build(spec, routing_S=routing_S, link_kw=link_kw)
+    result['build_s'] = time.perf_counter() - start
+    sim = event_sim.Simulator(seed=seed)
+    for obj in topo.object_L:
+        sim.add(obj)
+    router_L = list(topo.router_D.values())
+    monitor = convergence.ConvergenceMonitor(router_L, settle_time=0,
+                                             clock=sim.clock)
+    start = time.perf_counter()
+    # every router starts advertising, as it would when the network boots
+    for router in router_L:
+        for intf in router.router_intf_L:
+            sim.schedule(0, router.send_routes, intf)
+    sim.run()
+    # lost control packets are only made good by the periodic full updates,
+    # which run in the background: give them a few rounds
+    interval = router_L[0].full_update_interval if router_L else None
+    for _ in range(repair_rounds if interval else 0):
+        if monitor.check() or not monitor.quiescent:
+            break
+        sim.run(sim.now + interval)
+        sim.run()
+    result['converge_s'] = time.perf_counter() - start
+    result['converged'] = monitor.check()
+    result['convergence_time'] = monitor.convergence_time
+    result['control_messages'] = monitor.control_messages
+    result['control_lost'] = monitor.control_lost
+    return topo, sim, monitor, result
+
+
+# send packets between every ordered pair of hosts and time their delivery
+# @param trace_rate: fraction of the packets to trace, 0 for none
+def forward(topo, sim, packets, trace_rate=0):
+    result = {}
+    host_L = list(topo.host_D.values())
+    pair_L = [(src, dst) for src in host_L for dst in host_L if src is not dst]
+    # the simulator has the hosts receive as packets arrive, so their in
+    # queues stay short and the counters tell what was delivered
+    received_base = sum(host.intf_L[0].in_dequeued for host in host_L)
+    peer_D = {}
+    for link in topo.link_layer.link_L:
+        peer_D[(link.node_1, link.node_1_intf)] = link.node_2
+        peer_D[(link.node_2, link.node_2_intf)] = link.node_1
+    hops = 0
+    sent = 0
+    for i in range(packets if pair_L else 0):
+        src, dst = pair_L[i % len(pair_L)]
+        sim.schedule(0, src.udt_send, dst.addr, 'PACKET_%d' % i)
+        sent += 1
+        hops += count_hops(topo, peer_D, src.addr, dst.addr) or 0
+    tracer = tracing.enable(trace_rate, clock=sim.clock) if trace_rate else None
+    start = time.perf_counter()
+    virtual_start = sim.now
+    sim.run()
+    elapsed = time.perf_counter() - start
+    virtual = sim.now - virtual_start
+    delivered = sum(host.intf_L[0].in_dequeued for host in host_L) - received_base
+    tracing.disable()
+    if tracer is not None:
+        # virtual time each traced packet spent in every stage
+        result['latency'] = tracer.report()
+    result['packets_sent'] = sent
+    result['packets_delivered'] = delivered
+    result['forward_s'] = elapsed
+    result['throughput_pps'] = delivered / elapsed if elapsed else None
+    # what the network itself sustains, bound by the link bandwidths and delays
+    result['forward_time'] = virtual
+    result['virtual_throughput_pps'] = delivered / virtual if virtual else None
+    result['hops'] = hops
+    # simulation cost of moving one packet across one link, not a latency:
+    # per hop latencies are the 'hop' histogram of a traced run
+    result['wall_us_per_hop'] = elapsed / hops * 1e6 if hops else None
+    # deepest router queue of the run and where it was
+    for depth, name, intf, in_or_out in topo.bottlenecks(1, hosts=False):
+        result['max_queue_depth'] = depth
+        result['max_queue_at'] = '%s-%d %s' % (name, intf, in_or_out)
+    return result
+
+
+# run one benchmark case
+# @param memory: also measure peak memory, in a second run under tracemalloc
+# @param trace_rate: fraction of the data packets to trace, 0 for none;
+#                    tracing runs the case in the 'object' wire format
+# @param link_kw: bandwidth, delay and loss of every link, see link_3.Link;
+#                 with them the virtual times reflect the links
+def run_case(kind_S, size, routing_S='dv', packets=1000, seed=0, memory=True,
+             trace_rate=0, link_kw=None):
+    spec = topology.generate(kind_S, size, seed=seed)
+    result = {'topology': kind_S, 'size': size, 'routing': routing_S,
+              'routers': len(spec['routers']), 'hosts': len(spec['hosts']),
+              'links': len(spec['links'])}
+    if link_kw:
+        result['link'] = dict(link_kw)
+        link_kw = dict(link_kw, seed=seed)
+    level_D = {name: channel.level for name, channel in netlog.channel_D.items()}
+    netlog.set_level(netlog.OFF)
+    wire_format = network_3.NetworkPacket.wire_format
+    if trace_rate:
+        network_3.NetworkPacket.wire_format = 'object'
+        result['wire_format'] = 'object'
+    try:
+        topo, sim, monitor, converge_D = converge(spec, routing_S, seed, link_kw)
+        result.update(converge_D)
+        result.update(forward(topo, sim, packets, trace_rate))
+        del topo, sim, monitor
+        if memory:
+            tracemalloc.start()
+            try:
+                converge(spec, routing_S, seed, link_kw)
+                result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    finally:
+        for name, level in level_D.items():
+            netlog.set_level(level, name)
+        network_3.NetworkPacket.wire_format = wire_format
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='control plane scaling benchmark')
+    parser.add_argument('--kinds', nargs='+', default=sorted(topology.generator_D),
+                        choices=sorted(topology.generator_D))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[16, 64, 256],
+                        help='rough number of routers')
+    parser.add_argument('--routing', nargs='+', default=['dv', 'ls'],
+                        choices=['dv', 'ls'])
+    parser.add_argument('--packets', type=int, default=1000,
+                        help='data packets forwarded per case')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace-rate', type=float, default=0,
+                        help='fraction of the data packets to trace for latency histograms')
+    parser.add_argument('--bandwidth', type=float, help='bits per second of every link')
+    parser.add_argument('--delay', type=float, help='propagation delay of every link in seconds')
+    parser.add_argument('--loss', type=float, help='loss probability of every link')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip the tracemalloc run')
+    parser.add_argument('-o', '--output', help='file to write, stdout by default')
+    args = parser.parse_args(argv)
+    link_kw = {name: getattr(args, name) for name in ('bandwidth', 'delay', 'loss')
+               if getattr(args, name) is not None}
+    result_L = []
+    for kind_S in args.kinds:
+        for size in args.sizes:
+            for routing_S in args.routing:
+                result = run_case(kind_S, size, routing_S, args.packets,
+                                  args.seed, args.memory, args.trace_rate, link_kw)
+                print('%s %d %s: converged in %.3fs, %d control messages, %.0f packets/s' %
+                      (kind_S, size, routing_S, result['converge_s'],
+                       result['control_messages'], result['throughput_pps'] or 0),
+                      file=sys.stderr)
+                result_L.append(result)
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'results': result_L}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
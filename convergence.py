@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+# Detects when the routing tables of a set of Routers have converged by
+# watching their control plane instead of sleeping for a fixed time. The
+# network is quiescent when every control packet sent has been processed
+# or lost, no router has a triggered update pending and none of that has
+# changed for settle_time. It has converged once it is quiescent and every
+# lost control packet has been made good by a newer update from its source,
+# which on lossy links takes the periodic full updates.
+
+
+# sum up the control plane counters of a set of routers
+# @return (sent, received, lost, routers with an update pending, last route
+#         change, lost control packets not made good yet)
+def control_state(router_L):
+    sent = received = lost = pending = unrepaired = 0
+    last_change = None
+    for r in router_L:
+        sent += r.ctrl_sent
+        received += r.ctrl_received
+        lost += r.control_lost()
+        if r.update_due is not None:
+            pending += 1
+        if r.last_change is not None and \
+                (last_change is None or r.last_change > last_change):
+            last_change = r.last_change
+        unrepaired += r.control_unrepaired()
+    return sent, received, lost, pending, last_change, unrepaired
+
+
+class ConvergenceMonitor:
+
+    # @param router_L: Routers to watch
+    # @param settle_time: seconds the control plane must stay quiet
+    # @param poll_interval: seconds between checks in wait()
+    # @param clock: time source, the routers' clock by default
+    def __init__(self, router_L, settle_time=0.05, poll_interval=0.005,
+                 clock=None):
+        self.router_L = list(router_L)
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        if clock is None:
+            clock = self.router_L[0].clock if self.router_L else time.monotonic
+        self.clock = clock
+        self.start()
+
+    # called when printing the object
+    def __str__(self):
+        if self.converged:
+            return 'converged in %.3fs after %d control messages' % \
+                (self.convergence_time, self.control_messages)
+        if self.quiescent:
+            return 'quiescent, %d control packets lost, after %d control messages' % \
+                (self.control_lost, self.control_messages)
+        return 'not converged after %d control messages' % self.control_messages
+
+    # start measuring from now
+    def start(self):
+        self.start_time = self.clock()
+        self.sent_base = sum(r.ctrl_sent for r in self.router_L)
+        self.lost_base = sum(r.control_lost() for r in self.router_L)
+        self.converged = False
+        self.quiescent = False
+        self.convergence_time = None  # from start() to the last route change
+        self.control_messages = 0  # control packets sent since start()
+        self.control_lost = 0  # control packets lost since start()
+        self.quiet_since = None
+        self.quiet_state = None
+
+    # snapshot of the control plane counters, see control_state
+    def state(self):
+        return control_state(self.router_L)
+
+    # check once whether the network is quiescent and update the report
+    # @return True if converged
+    def check(self):
+        now = self.clock()
+        state = self.state()
+        sent, received, lost, pending, last_change, unrepaired = state
+        self.control_messages = sent - self.sent_base
+        self.control_lost = lost - self.lost_base
+        if state != self.quiet_state:
+            # something happened since the last check
+            self.quiet_state = state
+            self.quiet_since = now
+        self.quiescent = sent == received + lost and not pending and \
+            now - self.quiet_since >= self.settle_time
+        if not self.quiescent or unrepaired:
+            self.converged = False
+            return False
+        self.converged = True
+        if last_change is None or last_change < self.start_time:
+            self.convergence_time = 0.0
+        else:
+            self.convergence_time = last_change - self.start_time
+        return True
+
+    # block until the network is quiescent
+    # @param timeout: seconds to give up after, None to wait forever
+    # @return True if converged, False on timeout
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.check():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+        return True
+
+    # wait() for the asyncio runtime, sleeping without blocking the loop
+    async def wait_async(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.check():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(self.poll_interval)
+        return True
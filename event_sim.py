@@ -0,0 +1,199 @@
+import heapq
+import random
+
+import network_3
+import link_3
+
+# Discrete-event simulator: drives Hosts, Routers and Links from a priority
+# queue of timestamped events on a virtual clock instead of one thread per
+# object. Runs are deterministic for a given seed and take only as long as
+# the work in them, no matter how much virtual time passes.
+
+
+# Wakes an object up at most once per scheduled activation. Interfaces call
+# set() on their in_ready/out_ready listeners whenever a packet is queued,
+# so an Activation stands in for the threading.Event a running thread would
+# wait on.
+class Activation:
+
+    # @param sim: Simulator to schedule on
+    # @param step: callable doing the object's work when activated
+    # @param delay: callable returning the delay before the activation fires
+    def __init__(self, sim, step, delay):
+        self.sim = sim
+        self.step = step
+        self.delay = delay
+        self.pending = False
+
+    # schedule the activation unless it already is
+    def set(self):
+        if not self.pending:
+            self.pending = True
+            self.sim.schedule(self.delay(), self.fire)
+
+    def fire(self):
+        self.pending = False
+        self.step()
+
+
+class Simulator:
+
+    # @param seed: seed for the random link delay jitter
+    # @param link_delay: virtual seconds a packet takes to cross a link
+    # @param jitter: maximum extra random delay per link crossing
+    # @param node_delay: virtual seconds a node takes to react to a packet
+    def __init__(self, seed=None, link_delay=0.001, jitter=0.0, node_delay=0.0):
+        self.now = 0.0
+        # heap of (time, order, foreground, callback, args); order breaks
+        # ties in scheduling order so runs are reproducible
+        self.event_L = []
+        self.order = 0
+        # number of queued events that are real work, as opposed to
+        # background timers such as periodic full routing updates
+        self.foreground = 0
+        self.rng = random.Random(seed)
+        self.link_delay = link_delay
+        self.jitter = jitter
+        self.node_delay = node_delay
+        self.object_L = []
+        # due time of the armed router and link timers {(object, kind): time}
+        self.timer_D = {}
+
+    # called when printing the object
+    def __str__(self):
+        return 'Simulator'
+
+    # current virtual time, handed to Routers as their clock
+    def clock(self):
+        return self.now
+
+    # schedule callback(*args) to run after delay virtual seconds
+    # @param foreground: False for background events that should not keep
+    #                    run() from returning
+    def schedule(self, delay, callback, *args, foreground=True):
+        self.schedule_at(self.now + delay, callback, *args, foreground=foreground)
+
+    # schedule callback(*args) to run at virtual time time
+    def schedule_at(self, time, callback, *args, foreground=True):
+        self.order += 1
+        if foreground:
+            self.foreground += 1
+        heapq.heappush(self.event_L, (max(time, self.now), self.order, foreground,
+                                      callback, args))
+
+    # register a Host, Router or LinkLayer; link layers must be added after
+    # all of their links
+    def add(self, obj):
+        if isinstance(obj, network_3.Host):
+            self.add_host(obj)
+        elif isinstance(obj, network_3.Router):
+            self.add_router(obj)
+        elif isinstance(obj, link_3.LinkLayer):
+            self.add_link_layer(obj)
+        else:
+            raise Exception('%s: cannot simulate %s' % (self, obj))
+        self.object_L.append(obj)
+
+    def add_host(self, host):
+        activation = Activation(self, lambda: self.step_host(host),
+                                self.get_node_delay)
+        for intf in host.intf_L:
+            intf.in_ready = activation
+
+    def add_router(self, router):
+        router.clock = self.clock
+        activation = Activation(self, lambda: self.step_router(router),
+                                self.get_node_delay)
+        for intf in router.intf_L:
+            intf.in_ready = activation
+
+    def add_link_layer(self, link_layer):
+        for link in link_layer.link_L:
+            activation = Activation(self, lambda link=link: self.step_link(link),
+                                    self.get_link_delay)
+            link.node_1.intf_L[link.node_1_intf].out_ready = activation
+            link.node_2.intf_L[link.node_2_intf].out_ready = activation
+            link.clock = self.clock
+
+    def get_node_delay(self):
+        return self.node_delay
+
+    def get_link_delay(self):
+        if self.jitter:
+            return self.link_delay + self.rng.uniform(0, self.jitter)
+        return self.link_delay
+
+    # receive everything that arrived at a host
+    def step_host(self, host):
+        while host.udt_receive() is not None:
+            pass
+
+    # process everything that arrived at a router and arm its update timers
+    def step_router(self, router):
+        while router.process_queues():
+            pass
+        router.flush_updates()
+        # a pending triggered update is real work, periodic full updates
+        # run in the background
+        self.arm_timer(router, 'update', router.update_due, True)
+        self.arm_timer(router, 'full', router.full_due, False)
+
+    # make sure the router gets stepped at time due, reusing an armed timer
+    # that fires no later
+    def arm_timer(self, router, kind, due, foreground):
+        if due is None:
+            return
+        armed = self.timer_D.get((router, kind))
+        if armed is not None and armed <= due:
+            return
+        self.timer_D[(router, kind)] = due
+        self.schedule_at(due, self.fire_timer, router, kind, due,
+                         foreground=foreground)
+
+    def fire_timer(self, router, kind, due):
+        if self.timer_D.get((router, kind)) == due:
+            del self.timer_D[(router, kind)]
+        self.step_router(router)
+
+    # move everything queued on a link across it
+    def step_link(self, link):
+        while link.tx_pkt():
+            pass
+        # come back when a packet in flight arrives or the token bucket
+        # has refilled for one still queued
+        due = link.next_due()
+        if due is not None:
+            self.arm_link(link, self.now + due)
+
+    # make sure the link gets stepped at time due, reusing an armed timer
+    # that fires no later
+    def arm_link(self, link, due):
+        armed = self.timer_D.get((link, 'link'))
+        if armed is not None and armed <= due:
+            return
+        self.timer_D[(link, 'link')] = due
+        self.schedule_at(due, self.fire_link, link, due)
+
+    def fire_link(self, link, due):
+        if self.timer_D.get((link, 'link')) == due:
+            del self.timer_D[(link, 'link')]
+        self.step_link(link)
+
+    # process events in time order
+    # @param until: virtual time to stop at; if None, run until no
+    #               foreground work is left, i.e. the network is quiescent
+    # @return the virtual time reached
+    def run(self, until=None):
+        while self.event_L:
+            if until is None and not self.foreground:
+                break
+            if until is not None and self.event_L[0][0] > until:
+                break
+            time, order, foreground, callback, args = heapq.heappop(self.event_L)
+            if foreground:
+                self.foreground -= 1
+            self.now = time
+            callback(*args)
+        if until is not None and until > self.now:
+            self.now = until
+        return self.now
@@ -1,5 +1,25 @@
 import queue
 import threading
+import asyncio
+import heapq
+import random
+import time
+
+import netlog
+import network_3
+import tracing
+
+## event log channels, see netlog
+link_log = netlog.channel('link') #packets crossing links
+thread_log = netlog.channel('thread') #objects starting and ending
+
+
+## @return size in bytes a packet takes on the wire, whatever format the interface queues carry it in
+def pkt_size(pkt_S):
+    if isinstance(pkt_S, (str, bytes, bytearray, memoryview)):
+        return len(pkt_S)
+    return pkt_S.header.size + len(pkt_S.data_B) #a NetworkPacket object
+
 
 ## An abstraction of a link between router interfaces
 class Link:
@@ -9,67 +29,319 @@ class Link:
     # @param node_1_intf: number of the interface on that node
     # @param node_2: node to which data will be transfered
     # @param node_2_intf: number of the interface on that node
-    def __init__(self, node_1, node_1_intf, node_2, node_2_intf):
+    # @param verbose: print the link when it is created
+    # @param bandwidth: bits per second in each direction, None for no limit
+    # @param delay: propagation delay in seconds
+    # @param loss: probability that a packet is lost on the way
+    # @param burst: bits the link may send back to back, one 1500 byte packet by default
+    # @param seed: seed for the random losses
+    def __init__(self, node_1, node_1_intf, node_2, node_2_intf, verbose=True,
+                 bandwidth=None, delay=0.0, loss=0.0, burst=12000, seed=None):
         self.node_1 = node_1
         self.node_1_intf = node_1_intf
         self.node_2 = node_2
         self.node_2_intf = node_2_intf
-        print('Created link %s' % self.__str__())
+        ## packets taken off the out queue at node_1 and at node_2, and how many of them were lost to a full in queue
+        self.moved_1_2 = self.moved_2_1 = self.lost = 0
+        network_3.registry.connect(str(node_1), node_1_intf, str(node_2), node_2_intf)
+        if bandwidth is not None and bandwidth <= 0:
+            raise Exception('%s: bandwidth must be positive: %s' % (self, bandwidth))
+        if not 0 <= loss < 1:
+            raise Exception('%s: loss must be in [0, 1): %s' % (self, loss))
+        self.bandwidth = bandwidth
+        self.delay = delay
+        self.loss = loss
+        self.burst = burst
+        ## links without any of the three take the plain path in tx_pkt
+        self.modeled = bandwidth is not None or delay > 0 or loss > 0
+        ## time source for the token buckets and the delay line; the simulator swaps in its virtual clock
+        self.clock = time.monotonic
+        ## token bucket of each direction in bits, may go negative to let a packet bigger than the burst through
+        self.tokens_L = [burst, burst]
+        self.refill_time = None
+        ## packets in flight, heap of (release time, order, destination node, interface, packet)
+        self.flight_L = []
+        self.order = 0
+        ## packets lost to the loss rate
+        self.dropped = 0
+        ## only lossy links draw random numbers; a generator is a few KB, too much to give every link
+        self.rng = random.Random(seed) if loss else None
+        if verbose:
+            print('Created link %s' % self.__str__())
         
     ## called when printing the object
     def __str__(self):
         return 'Link %s-%d - %s-%d' % (self.node_1, self.node_1_intf, self.node_2, self.node_2_intf)
         
-    ##transmit a packet between interfaces in each direction
-    def tx_pkt(self):
+    ## @return snapshot of the packet counters
+    def stats(self):
+        return {'moved_1_2': self.moved_1_2, 'moved_2_1': self.moved_2_1, 'lost': self.lost,
+                'dropped': self.dropped, 'in_flight': len(self.flight_L)}
+        
+    ##transmit packets between interfaces in each direction
+    # @param batch: most packets to move per direction
+    # @return number of packets moved
+    def tx_pkt(self, batch=1):
+        if self.modeled:
+            return self.tx_modeled(batch)
+        moved = 0
+        moved_1_2 = None #packets moved in the first direction, once it is done
         for (node_a, node_a_intf, node_b, node_b_intf) in \
         [(self.node_1, self.node_1_intf, self.node_2, self.node_2_intf), 
          (self.node_2, self.node_2_intf, self.node_1, self.node_1_intf)]: 
             intf_a = node_a.intf_L[node_a_intf]
             intf_b = node_b.intf_L[node_b_intf]
-            pkt_S = intf_a.get('out')
-            if pkt_S is None:
-                continue #continue if no packet to transfer
-            #otherwise transmit the packet
-            try:
-                intf_b.put(pkt_S, 'in')
-                print('%s: direction %s-%s -> %s-%s: transmitting packet "%s"' % \
-                    (self, node_a, node_a_intf, node_b, node_b_intf, pkt_S))
-            except queue.Full:
-                print('%s: direction %s-%s -> %s-%s: packet lost' % \
-                    (self, node_a, node_a_intf, node_b, node_b_intf))
-                pass
+            for _ in range(batch):
+                pkt_S = intf_a.get('out')
+                if pkt_S is None:
+                    break #go on to the other direction if no packet to transfer
+                #otherwise transmit the packet
+                moved += 1
+                if tracing.tracer is not None:
+                    tracing.tracer.stamp(pkt_S, 'tx')
+                try:
+                    intf_b.put(pkt_S, 'in')
+                    if link_log.info:
+                        link_log.log(netlog.INFO, '%s: direction %s-%s -> %s-%s: transmitting packet "%s"',
+                                     self, node_a, node_a_intf, node_b, node_b_intf, pkt_S)
+                except queue.Full:
+                    self.lost += 1
+                    intf_b.count_lost(pkt_S)
+                    if link_log.warning:
+                        link_log.log(netlog.WARNING, '%s: direction %s-%s -> %s-%s: packet lost',
+                                     self, node_a, node_a_intf, node_b, node_b_intf)
+                    pass
+            if moved_1_2 is None:
+                moved_1_2 = moved
+        self.moved_1_2 += moved_1_2
+        self.moved_2_1 += moved - moved_1_2
+        return moved
+        
+    ##tx_pkt for a link with a bandwidth, delay or loss rate: release the packets whose delay is over,
+    # then send what the token buckets allow into the delay line
+    # @return number of packets moved, taken off an out queue or released into an in queue
+    def tx_modeled(self, batch):
+        now = self.clock()
+        moved = 0
+        flight_L = self.flight_L
+        while flight_L and flight_L[0][0] <= now:
+            _, _, node_b, node_b_intf, pkt_S = heapq.heappop(flight_L)
+            moved += 1
+            self.deliver(node_b, node_b_intf, pkt_S)
+        if self.bandwidth is not None:
+            if self.refill_time is not None:
+                for d in (0, 1):
+                    self.tokens_L[d] = min(self.burst, self.tokens_L[d] + (now - self.refill_time) * self.bandwidth)
+            self.refill_time = now
+        for d, (node_a, node_a_intf, node_b, node_b_intf) in \
+        enumerate([(self.node_1, self.node_1_intf, self.node_2, self.node_2_intf), 
+                   (self.node_2, self.node_2_intf, self.node_1, self.node_1_intf)]): 
+            intf_a = node_a.intf_L[node_a_intf]
+            for _ in range(batch):
+                if self.bandwidth is not None and self.tokens_L[d] <= 0:
+                    break #wait for the bucket to refill, the packets stay on the out queue
+                pkt_S = intf_a.get('out')
+                if pkt_S is None:
+                    break
+                moved += 1
+                if d:
+                    self.moved_2_1 += 1
+                else:
+                    self.moved_1_2 += 1
+                if tracing.tracer is not None:
+                    tracing.tracer.stamp(pkt_S, 'tx')
+                if self.bandwidth is not None:
+                    self.tokens_L[d] -= pkt_size(pkt_S) * 8
+                if self.loss and self.rng.random() < self.loss:
+                    self.dropped += 1
+                    node_b.intf_L[node_b_intf].count_lost(pkt_S)
+                    if link_log.warning:
+                        link_log.log(netlog.WARNING, '%s: direction %s-%s -> %s-%s: packet dropped',
+                                     self, node_a, node_a_intf, node_b, node_b_intf)
+                    continue
+                if self.delay > 0:
+                    self.order += 1
+                    heapq.heappush(flight_L, (now + self.delay, self.order, node_b, node_b_intf, pkt_S))
+                else:
+                    self.deliver(node_b, node_b_intf, pkt_S)
+        return moved
+        
+    ## put a packet that crossed the link on the in queue at its far end
+    def deliver(self, node_b, node_b_intf, pkt_S):
+        try:
+            node_b.intf_L[node_b_intf].put(pkt_S, 'in')
+            if link_log.info:
+                link_log.log(netlog.INFO, '%s: -> %s-%s: transmitting packet "%s"',
+                             self, node_b, node_b_intf, pkt_S)
+        except queue.Full:
+            self.lost += 1
+            node_b.intf_L[node_b_intf].count_lost(pkt_S)
+            if link_log.warning:
+                link_log.log(netlog.WARNING, '%s: -> %s-%s: packet lost', self, node_b, node_b_intf)
+        
+    ## @return seconds until tx_pkt has more to do without new packets being queued: a packet in flight
+    #  arriving or an empty token bucket refilling for a waiting packet; None if nothing is pending
+    def next_due(self):
+        if not self.modeled:
+            return None
+        now = self.clock()
+        due = self.flight_L[0][0] - now if self.flight_L else None
+        if self.bandwidth is not None:
+            for d, (node, intf) in enumerate([(self.node_1, self.node_1_intf), (self.node_2, self.node_2_intf)]):
+                intf = node.intf_L[intf]
+                if self.tokens_L[d] <= 0 and intf.out_enqueued > intf.out_dequeued:
+                    #time for the bucket to get back above zero
+                    wait = (1 - self.tokens_L[d]) / self.bandwidth
+                    if due is None or wait < due:
+                        due = wait
+        return None if due is None else max(due, 0.0)
         
         
 ## An abstraction of the link layer
 class LinkLayer:
     
-    def __init__(self):
+    ## @param workers: number of threads run uses, each owning every workers-th link
+    # @param batch: most packets a link moves per direction in one sweep
+    def __init__(self, workers=1, batch=1):
         ## list of links in the network
         self.link_L = []
+        self.workers = workers
+        self.batch = batch
+        ## one event per worker, set when a packet is put into the out queue of one of its links (or on stop)
+        self.wakeup_L = [threading.Event() for _ in range(workers)]
+        self.wakeup = self.wakeup_L[0]
         self.stop = False #for thread termination
         
+    ## setting stop also wakes the thread so it can terminate right away
+    @property
+    def stop(self):
+        return self._stop
+    
+    @stop.setter
+    def stop(self, value):
+        self._stop = value
+        if value:
+            for wakeup in self.wakeup_L:
+                wakeup.set()
+        
     ## called when printing the object
     def __str__(self):
         return 'Network'
     
     ##add a Link to the network
     def add_link(self, link):
+        #get the worker owning the link woken up whenever either end has something to send
+        wakeup = self.wakeup_L[len(self.link_L) % self.workers]
         self.link_L.append(link)
+        link.node_1.intf_L[link.node_1_intf].out_ready = wakeup
+        link.node_2.intf_L[link.node_2_intf].out_ready = wakeup
         
-    ##transfer a packet across all links
-    def transfer(self):
-        for link in self.link_L:
-            link.tx_pkt()
+    ##transfer packets across the links
+    # @param link_L: links to sweep, all of them by default
+    # @return number of packets moved
+    def transfer(self, link_L=None):
+        moved = 0
+        for link in self.link_L if link_L is None else link_L:
+            moved += link.tx_pkt(self.batch)
+        return moved
+        
+    ## @return seconds until one of the links has packets to release or tokens to send with, None if none does
+    def next_due(self, link_L=None):
+        due = None
+        for link in self.link_L if link_L is None else link_L:
+            link_due = link.next_due()
+            if link_due is not None and (due is None or link_due < due):
+                due = link_due
+        return due
                 
     ## thread target for the network to keep transmitting data across links
     def run(self):
-        print (threading.currentThread().getName() + ': Starting')
+        if thread_log.info:
+            thread_log.log(netlog.INFO, '%s: Starting', threading.current_thread().name)
+        if self.workers == 1:
+            self.run_links(0)
+        else:
+            #one thread per disjoint subset of the links
+            thread_L = [threading.Thread(name='%s-%d' % (threading.current_thread().name, k),
+                                         target=self.run_links, args=(k,))
+                        for k in range(self.workers)]
+            for t in thread_L:
+                t.start()
+            for t in thread_L:
+                t.join()
+        if thread_log.info:
+            thread_log.log(netlog.INFO, '%s: Ending', threading.current_thread().name)
+        
+    ## keep transmitting data across the links owned by worker k
+    def run_links(self, k):
+        link_L = self.link_L[k::self.workers]
+        wakeup = self.wakeup_L[k]
+        timeout = None
         while True:
-            #transfer one packet on all the links
-            self.transfer()
+            #block until one of our interfaces has a packet to send, a packet in flight is due or stop is set
+            wakeup.wait(timeout)
+            wakeup.clear()
+            #keep transferring packets on our links until they are all idle
+            while self.transfer(link_L):
+                pass
+            timeout = self.next_due(link_L)
             #terminate
             if self.stop:
-                print (threading.currentThread().getName() + ': Ending')
                 return
+                
+    ## coroutine doing the job of run on an asyncio event loop; only the links that have something queued are swept
+    async def arun(self):
+        if thread_log.info:
+            thread_log.log(netlog.INFO, '%s: Starting', self)
+        self.wakeup = asyncio.Event()
+        self.wakeup_L = [self.wakeup]
+        #links with packets waiting {link: None}, all of them to begin with in case packets were queued before we started
+        ready_D = dict.fromkeys(self.link_L)
+        for link in self.link_L:
+            link_ready = LinkReady(link, ready_D, self.wakeup)
+            link.node_1.intf_L[link.node_1_intf].out_ready = link_ready
+            link.node_2.intf_L[link.node_2_intf].out_ready = link_ready
+        #links with packets in flight or waiting for tokens {link: None}, swept again when the timer fires
+        pending_D = {}
+        timer = None
+        loop = asyncio.get_running_loop()
+        def fire():
+            ready_D.update(pending_D)
+            self.wakeup.set()
+        self.wakeup.set()
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while ready_D:
+                link_L = list(ready_D)
+                ready_D.clear()
+                for link in link_L:
+                    if link.tx_pkt(self.batch):
+                        ready_D[link] = None #there may be more behind it
+                    elif link.next_due() is not None:
+                        pending_D[link] = None
+                    else:
+                        pending_D.pop(link, None)
+            if timer is not None:
+                timer.cancel()
+                timer = None
+            due = self.next_due(pending_D)
+            if due is not None:
+                timer = loop.call_later(due, fire)
+            if self.stop:
+                if thread_log.info:
+                    thread_log.log(netlog.INFO, '%s: Ending', self)
+                return
+                
+                
+## out_ready listener used by LinkLayer.arun: marks its link ready and wakes the link layer
+class LinkReady:
     
+    def __init__(self, link, ready_D, wakeup):
+        self.link = link
+        self.ready_D = ready_D
+        self.wakeup = wakeup
+        
+    def set(self):
+        self.ready_D[self.link] = None
+        self.wakeup.set()
@@ -0,0 +1,111 @@
+import collections
+import sys
+import time
+
+# Structured, level-gated event log for the network objects, replacing the
+# print on every packet hop. Each event goes to a subsystem channel ('host',
+# 'router', 'routing', 'link', 'thread') at a level. Call sites test the
+# channel's flag for the level before building the event:
+#
+#   if router_log.info:
+#       router_log.log(netlog.INFO, '%s: forwarding packet "%s"', self, p)
+#
+# so a disabled level costs one attribute lookup and no string formatting.
+# Events are kept as (time, channel, level, format, args) and only
+# formatted when printed or dumped. By default enabled events are printed
+# as before; an optional ring buffer keeps the last N for post-mortems.
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+level_S_D = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+# print enabled events to this file (stdout if None); False to not print
+echo = None
+# last events logged, None when not recording
+ring = None
+# time source for the event timestamps
+clock = time.monotonic
+# channels by name
+channel_D = {}
+
+
+class Channel:
+
+    # @param name: subsystem name
+    # @param level: lowest level logged
+    def __init__(self, name, level=INFO):
+        self.name = name
+        self.set_level(level)
+
+    # called when printing the object
+    def __str__(self):
+        return self.name
+
+    # enable the given level and the ones above it; the flags are what the
+    # call sites test
+    def set_level(self, level):
+        self.level = level
+        self.debug = level <= DEBUG
+        self.info = level <= INFO
+        self.warning = level <= WARNING
+        self.error = level <= ERROR
+
+    # record an event; callers check the level flag first
+    # @param fmt_S: %-format string, applied to arg_L only when needed
+    def log(self, level, fmt_S, *arg_L):
+        if ring is not None:
+            ring.append((clock(), self.name, level, fmt_S, arg_L))
+        if echo is not False:
+            print(fmt_S % arg_L if arg_L else fmt_S, file=echo or sys.stdout)
+
+
+# get the channel of a subsystem, creating it on first use
+def channel(name):
+    try:
+        return channel_D[name]
+    except KeyError:
+        channel_D[name] = Channel(name)
+        return channel_D[name]
+
+
+# set the level of the named channels, all of them by default
+def set_level(level, *name_L):
+    for name in name_L or list(channel_D):
+        channel(name).set_level(level)
+
+
+# print enabled events to out, None for stdout, False to not print them
+def set_echo(out):
+    global echo
+    echo = out
+
+
+# keep the last ring_size events logged in a ring buffer, 0 to stop
+def record(ring_size):
+    global ring
+    ring = collections.deque(ring or (), ring_size) if ring_size else None
+
+
+# timestamp events with clock_fn, e.g. a Simulator's virtual clock
+def set_clock(clock_fn):
+    global clock
+    clock = clock_fn
+
+
+# the recorded events as dicts, oldest first
+def records():
+    for when, name, level, fmt_S, arg_L in list(ring or ()):
+        yield {'time': when, 'channel': name, 'level': level_S_D.get(level, level),
+               'message': fmt_S % arg_L if arg_L else fmt_S}
+
+
+# write the recorded events out, oldest first
+# @param out: file to write to, stdout by default
+def dump(out=None):
+    out = out or sys.stdout
+    for record in records():
+        out.write('%.6f %-7s %-7s %s\n' %
+                  (record['time'], record['channel'], record['level'], record['message']))
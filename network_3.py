@@ -1,7 +1,25 @@
 import queue
 import threading
-import json
-from copy import deepcopy
+import asyncio
+import struct
+import sys
+from array import array
+import heapq
+import random
+import time
+import collections
+
+import netlog
+import tracing
+
+# route cost advertised for a destination that is no longer reachable
+INFINITY = 2 ** 31 - 1
+
+# event log channels, see netlog
+host_log = netlog.channel('host')  # packets sent and received by hosts
+router_log = netlog.channel('router')  # data packets forwarded by routers
+routing_log = netlog.channel('routing')  # control plane messages and route changes
+thread_log = netlog.channel('thread')  # objects starting and ending
 
 # wrapper class for a queue of packets
 
@@ -9,8 +27,65 @@ from copy import deepcopy
 class Interface:
     # @param maxsize - the maximum size of the queue storing packets
     def __init__(self, maxsize=0):
-        self.in_queue = queue.Queue(maxsize)
-        self.out_queue = queue.Queue(maxsize)
+        if maxsize:
+            self.in_queue = queue.Queue(maxsize)
+            self.out_queue = queue.Queue(maxsize)
+        else:
+            # unbounded queues never block on put, so the much cheaper
+            # SimpleQueue does the same job
+            self.in_queue = queue.SimpleQueue()
+            self.out_queue = queue.SimpleQueue()
+        # events set whenever a packet is put into the in or out queue:
+        # in_ready wakes the node owning the interface, out_ready wakes
+        # the link layer that drains it (None if nobody is listening)
+        self.in_ready = None
+        self.out_ready = None
+        self.reset_stats()
+
+    # control packets lost on their way in or out of this interface: to
+    # the link's loss rate, a full in queue or a drop policy. Nobody will
+    # ever receive them, so the convergence monitor waits for newer updates
+    # to make up for them (see Router.control_unrepaired)
+    ctrl_lost = 0
+    # the last of those lost on the way in from each source
+    # {source: (sequence number, type, entries)}, created on the first loss
+    lost_D = None
+
+    # count a packet lost on its way into this interface
+    def count_lost(self, pkt):
+        if classify(pkt) == 0:
+            self.ctrl_lost += 1
+            if self.lost_D is None:
+                self.lost_D = {}
+            note_lost(self.lost_D, pkt)
+
+    # @return control packets lost at this interface
+    def control_lost(self):
+        return self.ctrl_lost
+
+    # @return the last control packet lost from each source on its way 'in'
+    #         or 'out' of this interface {source: (sequence number, type, entries)}
+    def lost_control(self, in_or_out):
+        if in_or_out == 'out' or self.lost_D is None:
+            return {}
+        # a copy, the link may be adding to it
+        return self.lost_D.copy()
+
+    # zero the packet counters; each direction has one thread putting and
+    # one getting, so plain integers count exactly
+    def reset_stats(self):
+        self.in_enqueued = self.in_dequeued = self.in_dropped = self.in_high_water = 0
+        self.out_enqueued = self.out_dequeued = self.out_dropped = self.out_high_water = 0
+
+    # @return snapshot of the packet counters
+    #         {'in' or 'out': {counter: value}}, depth being the packets queued now
+    def stats(self):
+        return {'in': {'enqueued': self.in_enqueued, 'dequeued': self.in_dequeued,
+                       'dropped': self.in_dropped, 'high_water': self.in_high_water,
+                       'depth': self.in_enqueued - self.in_dequeued},
+                'out': {'enqueued': self.out_enqueued, 'dequeued': self.out_dequeued,
+                        'dropped': self.out_dropped, 'high_water': self.out_high_water,
+                        'depth': self.out_enqueued - self.out_dequeued}}
 
     # get packet from the queue interface
     # @param in_or_out - use 'in' or 'out' interface
@@ -20,11 +95,17 @@ class Interface:
                 pkt_S = self.in_queue.get(False)
                 # if pkt_S is not None:
                 #     print('getting packet from the IN queue')
+                self.in_dequeued += 1
+                if tracing.tracer is not None:
+                    tracing.tracer.stamp(pkt_S, 'get_in')
                 return pkt_S
             else:
                 pkt_S = self.out_queue.get(False)
                 # if pkt_S is not None:
                 #     print('getting packet from the OUT queue')
+                self.out_dequeued += 1
+                if tracing.tracer is not None:
+                    tracing.tracer.stamp(pkt_S, 'get_out')
                 return pkt_S
         except queue.Empty:
             return None
@@ -36,10 +117,462 @@ class Interface:
     def put(self, pkt, in_or_out, block=False):
         if in_or_out == 'out':
             # print('putting packet in the OUT queue')
-            self.out_queue.put(pkt, block)
+            # stamped first, the getting thread may stamp as soon as it is in
+            if tracing.tracer is not None:
+                tracing.tracer.stamp(pkt, 'put_out')
+            try:
+                self.out_queue.put(pkt, block)
+            except queue.Full:
+                self.out_dropped += 1
+                raise
+            self.out_enqueued += 1
+            if self.out_enqueued - self.out_dequeued > self.out_high_water:
+                self.out_high_water = self.out_enqueued - self.out_dequeued
+            if self.out_ready is not None:
+                self.out_ready.set()
         else:
             # print('putting packet in the IN queue')
-            self.in_queue.put(pkt, block)
+            if tracing.tracer is not None:
+                tracing.tracer.stamp(pkt, 'put_in')
+            try:
+                self.in_queue.put(pkt, block)
+            except queue.Full:
+                self.in_dropped += 1
+                raise
+            self.in_enqueued += 1
+            if self.in_enqueued - self.in_dequeued > self.in_high_water:
+                self.in_high_water = self.in_enqueued - self.in_dequeued
+            if self.in_ready is not None:
+                self.in_ready.set()
+
+
+# interface for the asyncio runtime (see Host.arun, Router.arun), backed by
+# asyncio.Queue; it must only be used from the thread running the event
+# loop, where nothing can wait for room in a full queue, so put raises
+# queue.Full right away whether block is set or not
+class AsyncInterface(Interface):
+    # @param maxsize - the maximum size of the queue storing packets
+    def __init__(self, maxsize=0):
+        self.in_queue = asyncio.Queue(maxsize)
+        self.out_queue = asyncio.Queue(maxsize)
+        self.in_ready = None
+        self.out_ready = None
+        self.reset_stats()
+
+    # get packet from the queue interface
+    # @param in_or_out - use 'in' or 'out' interface
+    def get(self, in_or_out):
+        try:
+            if in_or_out == 'in':
+                pkt_S = self.in_queue.get_nowait()
+                self.in_dequeued += 1
+            else:
+                pkt_S = self.out_queue.get_nowait()
+                self.out_dequeued += 1
+            if tracing.tracer is not None:
+                tracing.tracer.stamp(pkt_S, 'get_' + in_or_out)
+            return pkt_S
+        except asyncio.QueueEmpty:
+            return None
+
+    # put the packet into the interface queue
+    # @param pkt - Packet to be inserted into the queue
+    # @param in_or_out - use 'in' or 'out' interface
+    # @param block - ignored, a full queue always throws queue.Full
+    def put(self, pkt, in_or_out, block=False):
+        if tracing.tracer is not None:
+            tracing.tracer.stamp(pkt, 'put_' + in_or_out)
+        if in_or_out == 'out':
+            try:
+                self.out_queue.put_nowait(pkt)
+            except asyncio.QueueFull:
+                self.out_dropped += 1
+                raise queue.Full
+            self.out_enqueued += 1
+            if self.out_enqueued - self.out_dequeued > self.out_high_water:
+                self.out_high_water = self.out_enqueued - self.out_dequeued
+            if self.out_ready is not None:
+                self.out_ready.set()
+        else:
+            try:
+                self.in_queue.put_nowait(pkt)
+            except asyncio.QueueFull:
+                self.in_dropped += 1
+                raise queue.Full
+            self.in_enqueued += 1
+            if self.in_enqueued - self.in_dequeued > self.in_high_water:
+                self.in_high_water = self.in_enqueued - self.in_dequeued
+            if self.in_ready is not None:
+                self.in_ready.set()
+
+
+# Drop policies for RingInterface. A policy is asked whether to queue a
+# packet once the ring holds at least threshold packets:
+#   admit(ring) -> True to queue the packet, False to drop it
+# threshold is the ring capacity for policies that only act on a full ring.
+
+# drop the arriving packet when the ring is full
+class TailDrop:
+
+    def __init__(self, capacity):
+        self.threshold = capacity
+
+    def admit(self, ring):
+        return False
+
+
+# drop the oldest queued packet to make room for the arriving one, so
+# what gets through is as fresh as possible; removing a packet from the
+# head of the ring races with the consumer, so the ring is locked
+class HeadDrop:
+    locked = True
+
+    def __init__(self, capacity):
+        self.threshold = capacity
+
+    # called with the ring lock held
+    def admit(self, ring):
+        pkt = ring.pop()
+        ring.head_dropped += 1
+        if classify(pkt) == 0:
+            ring.ctrl_dropped += 1
+            note_lost(ring.lost_D, pkt)
+        return True
+
+
+# random early detection: keep an exponentially weighted average of the
+# queue depth and, once it is past min_th, drop arriving packets with a
+# probability growing linearly to max_p at max_th, and all of them beyond;
+# senders see loss before the queue is full
+class RED:
+
+    # @param min_th, max_th: average depths, as fractions of the capacity
+    # @param max_p: drop probability at max_th
+    # @param weight: weight of the current depth in the average
+    # @param seed: seed for the drop decisions
+    def __init__(self, capacity, min_th=0.25, max_th=0.75, max_p=0.1,
+                 weight=0.002, seed=None):
+        self.capacity = capacity
+        self.min_th = min_th * capacity
+        self.max_th = max_th * capacity
+        self.max_p = max_p
+        self.weight = weight
+        self.rng = random.Random(seed)
+        self.avg = 0.0
+        # the average has to see every arrival
+        self.threshold = 0
+
+    def admit(self, ring):
+        depth = ring.tail - ring.head
+        self.avg += self.weight * (depth - self.avg)
+        if depth >= self.capacity or self.avg >= self.max_th:
+            return False
+        if self.avg < self.min_th:
+            return True
+        p = self.max_p * (self.avg - self.min_th) / (self.max_th - self.min_th)
+        return self.rng.random() >= p
+
+
+# drop policies by name
+drop_policy_D = {'tail': TailDrop, 'head': HeadDrop, 'red': RED}
+
+
+# preallocated circular buffer for one producer and one consumer thread:
+# only the producer moves tail and only the consumer moves head (or the
+# producer under lock, for head drop), so neither needs a lock otherwise
+class Ring:
+
+    def __init__(self, capacity, policy):
+        self.buf_L = [None] * capacity
+        self.capacity = capacity
+        self.head = 0  # count of packets taken out, the next one is at head % capacity
+        self.tail = 0  # count of packets put in
+        self.policy = policy
+        self.threshold = policy.threshold
+        self.lock = threading.Lock() if getattr(policy, 'locked', False) else None
+        self.head_dropped = 0  # packets the policy removed from the head
+        self.ctrl_dropped = 0  # control packets among them
+        self.lost_D = {}  # the last of those from each source, see note_lost
+
+    # @return the oldest packet, or None if empty
+    def pop(self):
+        head = self.head
+        if head == self.tail:
+            return None
+        slot = head % self.capacity
+        pkt = self.buf_L[slot]
+        self.buf_L[slot] = None
+        self.head = head + 1
+        return pkt
+
+
+# interface on bounded ring buffers instead of queue.Queue, for the common
+# case of one thread putting and one getting in each direction (the node on
+# one side, the link on the other). A full ring never blocks: the drop
+# policy decides what is lost, and put throws queue.Full when it is the
+# packet being put, whether block is set or not, as a congested router
+# would drop rather than stall.
+class RingInterface(Interface):
+
+    # @param maxsize - capacity of each ring, must be set
+    # @param policy - drop policy: a name in drop_policy_D, or a callable
+    #                 making a policy from the capacity
+    def __init__(self, maxsize, policy='tail'):
+        if maxsize <= 0:
+            raise Exception('RingInterface: needs a max_queue_size, got %s' % maxsize)
+        make_policy = drop_policy_D[policy] if isinstance(policy, str) else policy
+        self.in_ring = Ring(maxsize, make_policy(maxsize))
+        self.out_ring = Ring(maxsize, make_policy(maxsize))
+        self.in_ready = None
+        self.out_ready = None
+        self.reset_stats()
+
+    # @return snapshot of the packet counters, as Interface.stats; dropped
+    #         includes packets dropped from the head of the ring
+    def stats(self):
+        stats_D = Interface.stats(self)
+        for in_or_out, ring in (('in', self.in_ring), ('out', self.out_ring)):
+            stats_D[in_or_out]['dropped'] += ring.head_dropped
+            stats_D[in_or_out]['depth'] = ring.tail - ring.head
+        return stats_D
+
+    # @return control packets lost at this interface, including those
+    #         dropped from the head of the rings
+    def control_lost(self):
+        return self.ctrl_lost + self.in_ring.ctrl_dropped + self.out_ring.ctrl_dropped
+
+    # @return the last control packet lost from each source on its way 'in'
+    #         or 'out', as Interface.lost_control, including those dropped
+    #         from the head of the ring
+    def lost_control(self, in_or_out):
+        lost_D = Interface.lost_control(self, in_or_out)
+        ring = self.in_ring if in_or_out == 'in' else self.out_ring
+        for src, lost in ring.lost_D.copy().items():
+            if src not in lost_D or lost[0] >= lost_D[src][0]:
+                lost_D[src] = lost
+        return lost_D
+
+    # get packet from the queue interface
+    # @param in_or_out - use 'in' or 'out' interface
+    def get(self, in_or_out):
+        ring = self.in_ring if in_or_out == 'in' else self.out_ring
+        if ring.lock is None:
+            pkt_S = ring.pop()
+        else:
+            with ring.lock:
+                pkt_S = ring.pop()
+        if pkt_S is None:
+            return None
+        if in_or_out == 'in':
+            self.in_dequeued += 1
+        else:
+            self.out_dequeued += 1
+        if tracing.tracer is not None:
+            tracing.tracer.stamp(pkt_S, 'get_' + in_or_out)
+        return pkt_S
+
+    # put the packet into the interface queue
+    # @param pkt - Packet to be inserted into the queue
+    # @param in_or_out - use 'in' or 'out' interface
+    # @param block - ignored, see the class comment
+    def put(self, pkt, in_or_out, block=False):
+        if tracing.tracer is not None:
+            tracing.tracer.stamp(pkt, 'put_' + in_or_out)
+        if in_or_out == 'in':
+            ring = self.in_ring
+            ready = self.in_ready
+        else:
+            ring = self.out_ring
+            ready = self.out_ready
+        if ring.lock is None:
+            self.push(ring, pkt, in_or_out)
+        else:
+            with ring.lock:
+                self.push(ring, pkt, in_or_out)
+        if ready is not None:
+            ready.set()
+
+    # queue pkt on ring, or drop it as the policy decides
+    def push(self, ring, pkt, in_or_out):
+        tail = ring.tail
+        depth = tail - ring.head
+        if depth >= ring.threshold and not ring.policy.admit(ring):
+            if in_or_out == 'in':
+                self.in_dropped += 1
+            else:
+                self.out_dropped += 1
+            raise queue.Full
+        depth = tail - ring.head + 1
+        ring.buf_L[tail % ring.capacity] = pkt
+        ring.tail = tail + 1
+        if in_or_out == 'in':
+            self.in_enqueued += 1
+            if depth > self.in_high_water:
+                self.in_high_water = depth
+        else:
+            self.out_enqueued += 1
+            if depth > self.out_high_water:
+                self.out_high_water = depth
+
+
+# traffic classes of PriorityInterface, highest priority first
+traffic_class_L = ['control', 'data']
+
+
+# @param pkt: an interface queue entry, a NetworkPacket or a byte string in
+#             either wire format
+# @return its traffic class, an index into traffic_class_L
+def classify(pkt):
+    if isinstance(pkt, NetworkPacket):
+        return 0 if pkt.prot_S == 'control' else 1
+    # the protocol code follows the destination in both wire formats
+    code = pkt[NetworkPacket.dst_S_length]
+    if code == 2 or code == '2':
+        return 0
+    return 1
+
+
+# record a lost control packet, unless a later one from its source was
+# lost already
+# @param lost_D: {source: (sequence number, type, entries)} to add it to
+# @param pkt: the packet, in any wire format
+def note_lost(lost_D, pkt):
+    type_S, src, seq, entries = decode_control(NetworkPacket.from_wire(pkt).data_B)
+    if src not in lost_D or seq >= lost_D[src][0]:
+        lost_D[src] = (seq, type_S, entries)
+
+
+# per traffic class FIFOs of one direction of a PriorityInterface; the
+# producer only appends and the consumer only pops (deque operations are
+# atomic), so like a Ring it needs no lock
+class ClassQueue:
+
+    # @param maxsize: capacity of each class, 0 for unbounded
+    # @param weight_L: packets served from each class in turn when they
+    #                  are all backlogged, None for strict priority
+    def __init__(self, maxsize, weight_L):
+        self.deque_L = [collections.deque() for _ in traffic_class_L]
+        self.maxsize = maxsize
+        self.weight_L = weight_L
+        self.current = 0  # class being served, for weighted scheduling
+        self.credit = weight_L[0] if weight_L else 0  # packets it has left
+        self.enqueued_L = [0] * len(traffic_class_L)
+        self.dequeued_L = [0] * len(traffic_class_L)
+        self.dropped_L = [0] * len(traffic_class_L)
+
+    # @return the next packet to send, None if all classes are empty
+    def pop(self):
+        if self.weight_L is None:
+            for cls, fifo in enumerate(self.deque_L):
+                if fifo:
+                    self.dequeued_L[cls] += 1
+                    return fifo.popleft()
+            return None
+        # weighted round robin: serve the current class until it runs out
+        # of credit or packets, then move on to the next
+        for _ in range(len(self.deque_L) + 1):
+            fifo = self.deque_L[self.current]
+            if fifo and self.credit > 0:
+                self.credit -= 1
+                self.dequeued_L[self.current] += 1
+                return fifo.popleft()
+            self.current = (self.current + 1) % len(self.deque_L)
+            self.credit = self.weight_L[self.current]
+        return None
+
+    # queue pkt in its class
+    # @return False if the class is full
+    def push(self, pkt):
+        cls = classify(pkt)
+        fifo = self.deque_L[cls]
+        if self.maxsize and len(fifo) >= self.maxsize:
+            self.dropped_L[cls] += 1
+            return False
+        fifo.append(pkt)
+        self.enqueued_L[cls] += 1
+        return True
+
+    def __len__(self):
+        return sum(len(fifo) for fifo in self.deque_L)
+
+
+# interface queuing control and data packets separately (see classify), so
+# routing updates are not stuck behind a data backlog: get serves control
+# first (strict priority) or the classes in proportion to their weights.
+# Each class has its own capacity, and as with RingInterface a full class
+# throws queue.Full on put whether block is set or not. To use it on
+# routers, pass it or e.g.
+#   functools.partial(PriorityInterface, weight_L=(4, 1))
+# as the intf_class.
+class PriorityInterface(Interface):
+
+    # @param maxsize - the maximum number of packets queued per class
+    # @param weight_L - packets taken from each class of traffic_class_L in
+    #                   turn, None for strict priority
+    def __init__(self, maxsize=0, weight_L=None):
+        if weight_L is not None and (len(weight_L) != len(traffic_class_L) or min(weight_L) < 1):
+            raise Exception('PriorityInterface: need a weight of at least 1 for each of %s: %s' %
+                            (traffic_class_L, weight_L))
+        self.in_queue = ClassQueue(maxsize, weight_L)
+        self.out_queue = ClassQueue(maxsize, weight_L)
+        self.in_ready = None
+        self.out_ready = None
+        self.reset_stats()
+
+    # @return snapshot of the packet counters, as Interface.stats with the
+    #         counters of every class {'classes': {class: {counter: value}}}
+    #         added to each direction
+    def stats(self):
+        stats_D = Interface.stats(self)
+        for in_or_out, class_q in (('in', self.in_queue), ('out', self.out_queue)):
+            stats_D[in_or_out]['classes'] = {
+                name: {'enqueued': class_q.enqueued_L[cls], 'dequeued': class_q.dequeued_L[cls],
+                       'dropped': class_q.dropped_L[cls], 'depth': len(class_q.deque_L[cls])}
+                for cls, name in enumerate(traffic_class_L)}
+        return stats_D
+
+    # get packet from the queue interface
+    # @param in_or_out - use 'in' or 'out' interface
+    def get(self, in_or_out):
+        if in_or_out == 'in':
+            pkt_S = self.in_queue.pop()
+            if pkt_S is None:
+                return None
+            self.in_dequeued += 1
+        else:
+            pkt_S = self.out_queue.pop()
+            if pkt_S is None:
+                return None
+            self.out_dequeued += 1
+        if tracing.tracer is not None:
+            tracing.tracer.stamp(pkt_S, 'get_' + in_or_out)
+        return pkt_S
+
+    # put the packet into the interface queue
+    # @param pkt - Packet to be inserted into the queue
+    # @param in_or_out - use 'in' or 'out' interface
+    # @param block - ignored, see the class comment
+    def put(self, pkt, in_or_out, block=False):
+        if tracing.tracer is not None:
+            tracing.tracer.stamp(pkt, 'put_' + in_or_out)
+        if in_or_out == 'in':
+            if not self.in_queue.push(pkt):
+                self.in_dropped += 1
+                raise queue.Full
+            self.in_enqueued += 1
+            if self.in_enqueued - self.in_dequeued > self.in_high_water:
+                self.in_high_water = self.in_enqueued - self.in_dequeued
+            if self.in_ready is not None:
+                self.in_ready.set()
+        else:
+            if not self.out_queue.push(pkt):
+                self.out_dropped += 1
+                raise queue.Full
+            self.out_enqueued += 1
+            if self.out_enqueued - self.out_dequeued > self.out_high_water:
+                self.out_high_water = self.out_enqueued - self.out_dequeued
+            if self.out_ready is not None:
+                self.out_ready.set()
 
 
 # Implements a network layer packet.
@@ -47,36 +580,113 @@ class NetworkPacket:
     # packet encoding lengths
     dst_S_length = 5
     prot_S_length = 1
+    # encoding produced by to_byte_S: 'binary' (struct header followed by
+    # the payload bytes) or 'string' (the original zero-filled text format).
+    # 'object' is for simulations running in a single process: interface
+    # queues carry the packet objects themselves (see to_wire) and packets
+    # are only serialized, as binary, when they leave the process
+    wire_format = 'binary'
+    # binary header: destination (null padded), protocol code, payload length
+    header = struct.Struct('!%dsBI' % dst_S_length)
+    # protocol codes used by both encodings
+    prot_code_D = {'data': 1, 'control': 2}
+    prot_S_D = {1: 'data', 2: 'control'}
+    # (time, event) stamps of a packet picked for latency tracing, see tracing
+    trace_L = None
 
     # @param dst: address of the destination host
-    # @param data_S: packet payload
+    # @param data_S: packet payload, a string for data packets and
+    #                bytes (see encode_control) for control packets
     # @param prot_S: upper layer protocol for the packet (data, or control)
     def __init__(self, dst, prot_S, data_S):
         self.dst = dst
         self.data_S = data_S
         self.prot_S = prot_S
 
+    # payload as a string; packets parsed from the binary format only hold
+    # a memoryview into the received buffer and decode it on first access
+    @property
+    def data_S(self):
+        if self._data_S is None:
+            self._data_S = str(self._data_B, 'utf-8')
+        return self._data_S
+
+    @data_S.setter
+    def data_S(self, data_S):
+        if isinstance(data_S, str):
+            self._data_S = data_S
+            self._data_B = None
+        else:
+            self._data_S = None
+            self._data_B = data_S
+
+    # payload as bytes (or a memoryview of them)
+    @property
+    def data_B(self):
+        if self._data_B is None:
+            self._data_B = self._data_S.encode('utf-8')
+        return self._data_B
+
     # called when printing the object
     def __str__(self):
-        return self.to_byte_S()
+        if self.prot_S == 'control':
+            return '%s%d%s' % (str(self.dst).zfill(self.dst_S_length),
+                               self.prot_code_D['control'],
+                               decode_control(self.data_B))
+        return self.to_string_S()
 
     # convert packet to a byte string for transmission over links
+    # using the configured wire_format
     def to_byte_S(self):
+        if self.wire_format == 'string':
+            return self.to_string_S()
+        return self.to_bytes()
+
+    # extract a packet object from a byte string in either wire format
+    # @param byte_S: byte string representation of the packet
+    @classmethod
+    def from_byte_S(self, byte_S):
+        if isinstance(byte_S, str):
+            return self.from_string_S(byte_S)
+        return self.from_bytes(byte_S)
+
+    # convert packet to what is put into an interface queue: the packet
+    # itself in 'object' mode, otherwise its byte string
+    def to_wire(self):
+        if self.wire_format == 'object':
+            return self
+        return self.to_byte_S()
+
+    # extract a packet object from an interface queue entry
+    # @param pkt: a NetworkPacket or a byte string in either wire format
+    @classmethod
+    def from_wire(self, pkt):
+        if isinstance(pkt, NetworkPacket):
+            return pkt
+        return self.from_byte_S(pkt)
+
+    # encode the packet in the text format
+    def to_string_S(self):
         byte_S = str(self.dst).zfill(self.dst_S_length)
         if self.prot_S == 'data':
             byte_S += '1'
         elif self.prot_S == 'control':
             byte_S += '2'
         else:
-            raise('%s: unknown prot_S option: %s' % (self, self.prot_S))
-        byte_S += self.data_S
+            raise Exception('%s: unknown prot_S option: %s' %
+                            (self.dst, self.prot_S))
+        if self.prot_S == 'control':
+            # binary control payloads map byte for byte onto latin-1
+            byte_S += str(self.data_B, 'latin-1')
+        else:
+            byte_S += self.data_S
         return byte_S
 
-    # extract a packet object from a byte string
-    # @param byte_S: byte string representation of the packet
+    # extract a packet object from the text format
+    # @param byte_S: string representation of the packet
     @classmethod
-    def from_byte_S(self, byte_S):
-        dst = byte_S[0: NetworkPacket.dst_S_length].strip('0')
+    def from_string_S(self, byte_S):
+        dst = byte_S[0: NetworkPacket.dst_S_length].lstrip('0')
         prot_S = byte_S[NetworkPacket.dst_S_length: NetworkPacket.dst_S_length
                         + NetworkPacket.prot_S_length]
         if prot_S == '1':
@@ -84,92 +694,528 @@ class NetworkPacket:
         elif prot_S == '2':
             prot_S = 'control'
         else:
-            raise('%s: unknown prot_S field: %s' % (self, prot_S))
+            raise Exception('%s: unknown prot_S field: %s' % (self, prot_S))
         data_S = byte_S[NetworkPacket.dst_S_length +
                         NetworkPacket.prot_S_length:]
+        if prot_S == 'control':
+            data_S = data_S.encode('latin-1')
         return self(dst, prot_S, data_S)
 
+    # encode the packet in the binary format
+    def to_bytes(self):
+        try:
+            prot_code = self.prot_code_D[self.prot_S]
+        except KeyError:
+            raise Exception('%s: unknown prot_S option: %s' %
+                            (self.dst, self.prot_S))
+        data_B = self.data_B
+        return self.header.pack(str(self.dst).encode('ascii'), prot_code,
+                                len(data_B)) + data_B
+
+    # extract a packet object from the binary format without copying the
+    # payload: the packet keeps a memoryview into byte_B
+    # @param byte_B: bytes-like representation of the packet
+    @classmethod
+    def from_bytes(self, byte_B):
+        view = memoryview(byte_B)
+        dst_B, prot_code, length = self.header.unpack_from(view)
+        try:
+            prot_S = self.prot_S_D[prot_code]
+        except KeyError:
+            raise Exception('%s: unknown prot_S field: %s' % (self, prot_code))
+        start = self.header.size
+        if len(view) - start != length:
+            raise Exception('%s: payload length %d does not match header %d' %
+                            (self, len(view) - start, length))
+        p = self.__new__(self)
+        p.dst = dst_B.rstrip(b'\0').decode('ascii')
+        p.prot_S = prot_S
+        p._data_S = None
+        p._data_B = view[start:]
+        return p
+
+
+# Routing control payloads are packed binary, version 1:
+#   header: version, message type, sequence number, entry count and the
+#           byte length of the name table
+#   names: newline separated ASCII node names, the sender first
+#   entries: (name index, interface, cost) triples of little-endian int32
+# Node names are interned: each is sent once per message and referred to by
+# its index, and decoded names go through sys.intern so every table keyed by
+# them shares one string object. All fields are packed and unpacked with
+# array slices rather than per entry Python code.
+CONTROL_VERSION = 1
+control_header = struct.Struct('<BBIII')
+control_type_D = {'full': 1, 'delta': 2, 'request': 3, 'lsa': 4}
+control_type_S_D = {code: type_S for type_S, code in control_type_D.items()}
+
+
+# encode a routing control message
+# @param type_S: 'full' or 'delta' routing table, 'request' for a full
+#                table or 'lsa' link state advertisement
+# @param src: name of the sending (originating) router
+# @param seq: sequence number of the message
+# @param entries: iterable of (name, interface, cost) triples, with integer
+#                 interface and cost
+# @return the payload bytes
+def encode_control(type_S, src, seq, entries):
+    entries = list(entries)
+    if entries:
+        dests, intfs, costs = zip(*entries)
+    else:
+        dests, intfs, costs = (), (), ()
+    names = list(dict.fromkeys((src,) + dests))
+    names_D = dict(zip(names, range(len(names))))
+    values = array('i', bytes(12 * len(entries)))
+    values[0::3] = array('i', map(names_D.__getitem__, dests))
+    values[1::3] = array('i', intfs)
+    values[2::3] = array('i', costs)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    names_B = '\n'.join(names).encode('ascii')
+    return b''.join((control_header.pack(CONTROL_VERSION,
+                                         control_type_D[type_S], seq,
+                                         len(entries), len(names_B)),
+                     names_B, values.tobytes()))
+
+
+# decode a routing control message produced by encode_control
+# @param data_B: the payload bytes or a memoryview of them
+# @return (type_S, src, seq, {name: (interface, cost)})
+def decode_control(data_B):
+    view = memoryview(data_B)
+    version, type_code, seq, entry_count, names_length = \
+        control_header.unpack_from(view)
+    if version != CONTROL_VERSION:
+        raise Exception('unsupported control message version %d' % version)
+    offset = control_header.size
+    names = list(map(sys.intern, str(view[offset: offset + names_length],
+                                     'ascii').split('\n')))
+    offset += names_length
+    values = array('i')
+    values.frombytes(view[offset: offset + 12 * entry_count])
+    if sys.byteorder != 'little':
+        values.byteswap()
+    entries = dict(zip(map(names.__getitem__, values[0::3]),
+                       zip(values[1::3], values[2::3])))
+    return control_type_S_D[type_code], names[0], seq, entries
+
 
 # Implements a network host for receiving and transmitting data
 class Host:
 
     # @param addr: address of this node represented as an integer
-    def __init__(self, addr):
+    # @param intf_class: Interface, or AsyncInterface to run with arun
+    def __init__(self, addr, intf_class=Interface):
         self.addr = addr
-        self.intf_L = [Interface()]
+        self.intf_L = [intf_class()]
+        registry.register(addr, 'host', self)
+        # set when a packet arrives on any interface (or on stop)
+        self.wakeup = threading.Event()
+        for intf in self.intf_L:
+            intf.in_ready = self.wakeup
         self.stop = False  # for thread termination
 
+    # setting stop also wakes the thread so it can terminate right away
+    @property
+    def stop(self):
+        return self._stop
+
+    @stop.setter
+    def stop(self, value):
+        self._stop = value
+        if value:
+            self.wakeup.set()
+
     # called when printing the object
     def __str__(self):
         return self.addr
 
+    # @return snapshot of the interface counters, see Interface.stats
+    def stats(self):
+        return {'interfaces': [intf.stats() for intf in self.intf_L]}
+
     # create a packet and enqueue for transmission
     # @param dst: destination address for the packet
     # @param data_S: data being transmitted to the network layer
     def udt_send(self, dst, data_S):
         p = NetworkPacket(dst, 'data', data_S)
-        print('%s: sending packet "%s"' % (self, p))
+        if tracing.tracer is not None:
+            tracing.tracer.start(p)
+        if host_log.info:
+            host_log.log(netlog.INFO, '%s: sending packet "%s"', self, p)
         # send packets always enqueued successfully
-        self.intf_L[0].put(p.to_byte_S(), 'out')
+        self.intf_L[0].put(p.to_wire(), 'out')
 
     # receive packet from the network layer
+    # @return the received packet, or None if the in queue was empty
     def udt_receive(self):
         pkt_S = self.intf_L[0].get('in')
-        if pkt_S is not None:
-            print('%s: received packet "%s"' % (self, pkt_S))
+        if pkt_S is not None and tracing.tracer is not None:
+            tracing.tracer.finish(pkt_S)
+        if pkt_S is not None and host_log.info:
+            host_log.log(netlog.INFO, '%s: received packet "%s"',
+                         self, NetworkPacket.from_wire(pkt_S))
+        return pkt_S
 
     # thread target for the host to keep receiving data
     def run(self):
-        print(threading.currentThread().getName() + ': Starting')
+        if thread_log.info:
+            thread_log.log(netlog.INFO, '%s: Starting', threading.current_thread().name)
         while True:
-            # receive data arriving to the in interface
-            self.udt_receive()
+            # block until a packet arrives or stop is set
+            self.wakeup.wait()
+            self.wakeup.clear()
+            # receive all data arriving to the in interface
+            while self.udt_receive() is not None:
+                pass
             # terminate
             if(self.stop):
-                print(threading.currentThread().getName() + ': Ending')
+                if thread_log.info:
+                    thread_log.log(netlog.INFO, '%s: Ending', threading.current_thread().name)
+                return
+
+    # coroutine doing the job of run on an asyncio event loop
+    async def arun(self):
+        if thread_log.info:
+            thread_log.log(netlog.INFO, '%s: Starting', self)
+        await_packets(self)
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.udt_receive() is not None:
+                pass
+            if self.stop:
+                if thread_log.info:
+                    thread_log.log(netlog.INFO, '%s: Ending', self)
                 return
 
 
+# dense integer IDs of the node names, used by the registry {name: ID},
+# and the names by ID
+node_id_D = {}
+node_name_L = []
+
+
+# @return the ID of a node name, giving it the next one if it has none
+def node_id(name):
+    try:
+        return node_id_D[name]
+    except KeyError:
+        node_id_D[name] = len(node_name_L)
+        node_name_L.append(name)
+        return node_id_D[name]
+
+
+# what the registry knows about a node
+class NodeInfo:
+    __slots__ = ('name', 'kind', 'id', 'node', 'peer_D')
+
+    def __init__(self, name, kind, node):
+        self.name = name
+        self.kind = kind  # 'host' or 'router'
+        self.id = node_id(name)
+        self.node = node  # the Host or Router, None if it is not in this process
+        self.peer_D = {}  # node at the other end of each linked interface {intf: (name, intf)}
+
+
+# Kinds, IDs and interfaces of the nodes, so code can tell routers from
+# hosts without going by their names. Hosts and Routers register themselves
+# when created and Links record the interfaces they connect; a topology
+# registers all of its nodes before building them, so a router knows which
+# of its neighbors are routers whatever order they are created in. A name
+# registered again, e.g. by the next topology built, takes the new entry.
+class NodeRegistry:
+
+    def __init__(self):
+        self.info_D = {}  # {name: NodeInfo}
+        self.router_S = set()  # names of the routers
+        self.router_id_S = set()  # and their IDs
+
+    # called when printing the object
+    def __str__(self):
+        return 'NodeRegistry'
+
+    # @param kind: 'host' or 'router'
+    # @param node: the Host or Router object, if there is one yet
+    # @return the NodeInfo
+    def register(self, name, kind, node=None):
+        if kind not in ('host', 'router'):
+            raise Exception('%s: unknown kind of node %s: %s' % (self, name, kind))
+        info = self.info_D.get(name)
+        if info is None or info.kind != kind:
+            info = self.info_D[name] = NodeInfo(name, kind, node)
+        elif node is not None:
+            if info.node is not node:
+                info.peer_D = {}
+            info.node = node
+        if kind == 'router':
+            self.router_S.add(name)
+            self.router_id_S.add(info.id)
+        else:
+            self.router_S.discard(name)
+            self.router_id_S.discard(info.id)
+        return info
+
+    # record a link between two nodes, unless one is not registered; a link
+    # between two routers also becomes one of their router_intf_L
+    def connect(self, name_1, intf_1, name_2, intf_2):
+        info_1 = self.info_D.get(name_1)
+        info_2 = self.info_D.get(name_2)
+        if info_1 is None or info_2 is None:
+            return
+        info_1.peer_D[intf_1] = (name_2, intf_2)
+        info_2.peer_D[intf_2] = (name_1, intf_1)
+        if info_1.kind == 'router' and info_2.kind == 'router':
+            for info, intf in ((info_1, intf_1), (info_2, intf_2)):
+                if info.node is not None and intf not in info.node.router_intf_L:
+                    info.node.router_intf_L.append(intf)
+
+    # @return 'host', 'router' or None if name is not registered
+    def kind(self, name):
+        info = self.info_D.get(name)
+        return None if info is None else info.kind
+
+    def is_router(self, name):
+        return name in self.router_S
+
+    # forget every node
+    def clear(self):
+        self.info_D.clear()
+        self.router_S.clear()
+        self.router_id_S.clear()
+
+
+# the nodes of this process
+registry = NodeRegistry()
+
+
+# the routes of one router, a column per destination: the cost and the
+# interface, INFINITY and -1 if there is no route. Columns are numbered by
+# the RoutingTable the row belongs to and the row only reaches as far as the
+# highest one routed, so a router that knows a few neighbors holds a few
+# entries however many nodes there are. order_A lists the columns routed in
+# the order their routes were added, as a dict would keep them. About 10
+# bytes per destination instead of the ~300 of a dict entry holding a
+# single entry dict.
+class RouteRow:
+    __slots__ = ('name_L', 'cost_A', 'intf_A', 'order_A')
+
+    # @param name_L: destination names by column, shared with the table
+    def __init__(self, name_L):
+        self.name_L = name_L
+        self.cost_A = array('i')
+        self.intf_A = array('h')
+        self.order_A = array('i')
+
+    def __len__(self):
+        return len(self.order_A)
+
+    # widen the row to take column c
+    def grow(self, c):
+        count = c + 1 - len(self.cost_A)
+        self.cost_A.extend(array('i', [INFINITY]) * count)
+        self.intf_A.extend(array('h', [-1]) * count)
+
+    # @return the cost to the destination in column c, None if there is no route
+    def cost(self, c):
+        if c < len(self.cost_A):
+            cost = self.cost_A[c]
+            if cost < INFINITY:
+                return cost
+        return None
+
+    # @return (interface, cost) of the route to the destination in column
+    #         c, None if there is none
+    def get(self, c):
+        if c < len(self.cost_A):
+            cost = self.cost_A[c]
+            if cost < INFINITY:
+                return self.intf_A[c], cost
+        return None
+
+    def set(self, c, intf, cost):
+        if c >= len(self.cost_A):
+            self.grow(c)
+        if self.cost_A[c] >= INFINITY:
+            self.order_A.append(c)
+        self.cost_A[c] = cost
+        self.intf_A[c] = intf
+
+    def remove(self, c):
+        if c < len(self.cost_A) and self.cost_A[c] < INFINITY:
+            self.cost_A[c] = INFINITY
+            self.intf_A[c] = -1
+            self.order_A.remove(c)
+
+    def clear(self):
+        del self.cost_A[:]
+        del self.intf_A[:]
+        del self.order_A[:]
+
+    # @return (destination name, interface, cost) of every route, oldest first
+    def items(self):
+        return [(self.name_L[c], self.intf_A[c], self.cost_A[c]) for c in self.order_A]
+
+
+# routing table of a router: its own routes and the last distance vector
+# each neighbor advertised, one RouteRow per router. The destinations are
+# numbered densely in the order the table first meets them {name: column},
+# and the rows share the numbering, so a column across the rows holds what
+# every neighbor advertised for one destination.
+class RoutingTable:
+    __slots__ = ('own', 'row_D', 'col_D', 'name_L')
+
+    # @param name: router whose table this is
+    def __init__(self, name):
+        self.col_D = {}
+        self.name_L = []
+        self.own = RouteRow(self.name_L)
+        self.row_D = {name: self.own}  # {router: RouteRow}, own row first
+
+    # @return the column of a destination, giving it the next one if it has none
+    def col(self, name):
+        try:
+            return self.col_D[name]
+        except KeyError:
+            self.col_D[name] = len(self.name_L)
+            self.name_L.append(name)
+            return self.col_D[name]
+
+    # @return the row of a router, a new empty one if it has none
+    def row(self, router):
+        row = self.row_D.get(router)
+        if row is None:
+            row = self.row_D[router] = RouteRow(self.name_L)
+        return row
+
+    # start a router's row over, keeping its place in row_D
+    # @return the new row
+    def replace(self, router):
+        row = self.row_D[router] = RouteRow(self.name_L)
+        return row
+
+    # @return (router, cost) of every neighbor row with a route to the
+    #         destination in column c
+    def column(self, c):
+        column_L = []
+        for router, row in self.row_D.items():
+            if row is not self.own:
+                cost = row.cost(c)
+                if cost is not None:
+                    column_L.append((router, cost))
+        return column_L
+
+
 # Implements a multi-interface router
 class Router:
 
     # @param name: friendly router name for debugging
     # @param cost_D: cost table to neighbors {neighbor: {interface: cost}}
     # @param max_queue_size: max queue length (passed to Interface)
-    def __init__(self, name, cost_D, max_queue_size):
+    # @param routing_S: control plane, 'dv' (distance vector) or 'ls' (link state)
+    # @param update_window: seconds to gather route changes before a triggered update
+    # @param update_interval: minimum seconds between two triggered updates
+    # @param full_update_interval: seconds between periodic full table updates,
+    #                              None to only send them on request
+    # @param verbose: print the initial routing table
+    # @param intf_class: Interface, or AsyncInterface to run with arun
+    def __init__(self, name, cost_D, max_queue_size, routing_S='dv',
+                 update_window=0.0, update_interval=0.0,
+                 full_update_interval=30.0, verbose=True, intf_class=Interface):
+        # set when a packet arrives on any interface (or on stop)
+        self.wakeup = threading.Event()
         self.stop = False  # for thread termination
         self.name = name
         # create a list of interfaces
-        self.intf_L = [Interface(max_queue_size) for _ in range(len(cost_D))]
+        self.intf_L = [intf_class(max_queue_size)
+                       for _ in range(len(cost_D))]
+        for intf in self.intf_L:
+            intf.in_ready = self.wakeup
         # save neighbors and interfeces on which we connect to them
-        self.cost_D = deepcopy(cost_D)    # {neighbor: {interface: cost}}
-        # TODO: set up the routing table for connected hosts
-        # self.calculate_costs(cost_D) # {destination: {router: cost}}
-        self.rt_tbl_D = deepcopy(cost_D)
-        print('%s: Initialized routing table' % self)
-        self.print_routes()
+        self.cost_D = {nbr: dict(route) for nbr, route in cost_D.items()}    # {neighbor: {interface: cost}}
+        # the same adjacency flattened for lookups {neighbor: (interface, cost)}
+        self.nbr_D = {}
+        for nbr, route in self.cost_D.items():
+            for intf, cost in route.items():
+                self.nbr_D[nbr] = (int(intf), cost)
+        # interfaces facing other routers, i.e. where routing updates go;
+        # neighbors registered later are added as Links connect them
+        registry.register(name, 'router', self)
+        self.router_intf_L = [intf for nbr, (intf, cost) in self.nbr_D.items()
+                              if nbr in registry.router_S]
+        # routing table: our own routes, which start out as the directly
+        # connected neighbors, and the latest distance vector advertised by
+        # each neighbor (with the neighbor's interfaces)
+        self.rt_tbl = RoutingTable(self.name)
+        self.my_routes = self.rt_tbl.own
+        for nbr, (intf, cost) in self.nbr_D.items():
+            self.my_routes.set(self.rt_tbl.col(nbr), intf, cost)
+        # whether we have advertised our routes yet
+        self.advertised = False
+        # distance vector updates are deltas against what each neighbor was
+        # last sent: destinations changed since then {interface: {dest: None}}
+        # (dicts keep the order changes happened in, so runs are repeatable),
+        # where interfaces that never got a full table have no entry
+        self.dirty_D = {}
+        # sequence numbers of the last update sent on each interface and
+        # received from each neighbor, used to detect lost deltas
+        self.tx_seq_D = {}
+        self.rx_seq_D = {}
+        # sequence number of the last full table sent on each interface
+        self.full_seq_D = {}
+        # neighbors we asked for a full table and are still waiting on
+        self.resync_S = set()
+        # triggered updates are coalesced: the first change arms a timer and
+        # everything that changes until it fires goes out as one update
+        self.clock = time.monotonic
+        self.update_window = update_window
+        self.update_interval = update_interval
+        self.update_due = None  # when the pending update fires, None if idle
+        self.last_update = None  # when the last triggered update went out
+        self.full_update_interval = full_update_interval
+        self.full_due = None  # when the next periodic full update goes out
+        # control plane activity, watched by convergence.ConvergenceMonitor
+        self.ctrl_sent = 0  # control packets put on an interface
+        self.ctrl_received = 0  # control packets fully processed
+        self.last_change = None  # clock time of the last route change
+        # data plane and route counters, see stats
+        self.data_forwarded = 0  # data packets put on an outgoing interface
+        self.data_dropped = 0  # data packets with no route or lost to a full queue
+        self.route_changes = 0  # destinations whose route changed
+        if routing_S not in ('dv', 'ls'):
+            raise Exception('%s: unknown routing_S option: %s' %
+                            (self, routing_S))
+        self.routing_S = routing_S
+        # link state database {router: (sequence number, {neighbor: cost})},
+        # holding our own adjacency as well
+        self.lsa_seq = 0
+        self.lsdb_D = {self.name: (self.lsa_seq,
+                                   {nbr: cost for nbr, (intf, cost) in self.nbr_D.items()})}
+        # shortest path tree from the last SPF run {destination: (cost, interface)}
+        self.spf_D = {}
+        if routing_S == 'ls':
+            self.run_spf()
+        if verbose:
+            print('%s: Initialized routing table' % self)
+            self.print_routes()
 
     # Print routing table
     def print_routes(self):
         routers = []
         hosts = []
 
-        if self.name in self.rt_tbl_D:
-            for nbr in self.rt_tbl_D[self.name]:
-                if "R" in str(nbr):
-                    routers.append(nbr)
-                hosts.append(nbr)
-        else:
-            for nbr in self.rt_tbl_D:
-                if "R" in str(nbr):
-                    routers.append(nbr)
-                hosts.append(nbr)
+        router_S = registry.router_S
+        for nbr in [dest for dest, intf, cost in self.my_routes.items()] + [self.name]:
+            if nbr in router_S:
+                routers.append(nbr)
+            hosts.append(nbr)
 
         routers = sorted(routers)
         hosts = sorted(hosts)
 
         # TODO: print the routes as a two dimensional table
-        sort_rt = sorted(self.rt_tbl_D)
+        sort_rt = sorted(self.rt_tbl.row_D)
         # Prints top border
         rt_tbl = "╒══════"
         for neighbor in hosts:
@@ -184,7 +1230,7 @@ class Router:
         rt_tbl += "┤\n"
         for router in routers:
             rt_tbl += "|%-6s" % router
-            if router not in self.rt_tbl_D:
+            if router not in self.rt_tbl.row_D:
                 for host in hosts:
                     rt_tbl += "|%6s" % "~"
                 rt_tbl += "|\n"
@@ -194,17 +1240,19 @@ class Router:
                     rt_tbl += "├──────┤\n"
                 continue
 
-            cur_r = self.rt_tbl_D[router]
+            cur_r = self.rt_tbl.row_D[router]
             for dest in hosts:
                 if dest == router:  # if trying to go to self
                     rt_tbl += "|%6s" % "0"
                     continue
                 else:
-                    if dest in cur_r:
-                        my_intf = list(cur_r[dest].keys())[0]
-                        rt_tbl += "|%6s" % cur_r[dest][my_intf]
+                    cost = cur_r.cost(self.rt_tbl.col_D.get(dest, INFINITY))
+                    if cost is not None:
+                        rt_tbl += "|%6s" % cost
                     else:
                         total_cost = self.calculate_cost(router, dest)
+                        if total_cost is None:
+                            total_cost = "~"
                         rt_tbl += "|%6s" % total_cost
             rt_tbl += "|\n"
             if router != routers[len(routers) - 1]:
@@ -220,149 +1268,543 @@ class Router:
         print(rt_tbl)
         print()
 
+    # estimate the cost from router to dest by going through this router,
+    # for neighbors that have not advertised a route to dest yet
+    # @return the cost, or None if either half of the path is unknown
     def calculate_cost(self, router, dest):
-        router_dist = list(self.rt_tbl_D[router].keys())[0]
-        router_dist = self.rt_tbl_D[router][router_dist]
-
-        host_dist = list(self.rt_tbl_D[dest].keys())[0]
-        host_dist = self.rt_tbl_D[dest][host_dist]
+        row = self.rt_tbl.row_D.get(router)
+        col_D = self.rt_tbl.col_D
+        router_dist = None if row is None else row.cost(col_D.get(self.name, INFINITY))
+        host_dist = self.my_routes.cost(col_D.get(dest, INFINITY))
+        if router_dist is None or host_dist is None:
+            return None
 
         total_cost = router_dist + host_dist
 
         return total_cost
 
+    # setting stop also wakes the thread so it can terminate right away
+    @property
+    def stop(self):
+        return self._stop
+
+    @stop.setter
+    def stop(self, value):
+        self._stop = value
+        if value:
+            self.wakeup.set()
+
     # called when printing the object
     def __str__(self):
         return self.name
 
+    # @return control packets lost on the way to or from our interfaces
+    def control_lost(self):
+        return sum(intf.control_lost() for intf in self.intf_L)
+
+    # @return number of sources of lost control packets whose updates have
+    #         not been made good since, plus the neighbors we are waiting on
+    #         for a full table; what the periodic full updates have yet to repair
+    def control_unrepaired(self):
+        unrepaired = len(self.resync_S)
+        for i, intf in enumerate(self.intf_L):
+            for in_or_out in ('in', 'out'):
+                for src, lost in intf.lost_control(in_or_out).items():
+                    if not self.made_good(i, in_or_out, src, lost):
+                        unrepaired += 1
+        return unrepaired
+
+    # @param i: interface the control packet was lost at
+    # @param in_or_out: whether it was on its way in or out
+    # @param src: its source
+    # @param lost: (sequence number, type, entries) it carried
+    # @return whether what it carried has reached the router it was going
+    #         to since, in a copy or a newer update
+    def made_good(self, i, in_or_out, src, lost):
+        seq, type_S, entries = lost
+        if in_or_out == 'out':
+            # ask the neighbor it was going to, if it is in this process
+            peer = registry.info_D[self.name].peer_D.get(i) if self.name in registry.info_D else None
+            info = None if peer is None else registry.info_D.get(peer[0])
+            if info is not None and isinstance(info.node, Router):
+                return info.node.made_good(peer[1], 'in', src, lost)
+            # otherwise go by what we sent on i since
+            if self.routing_S == 'ls':
+                lsa = self.lsdb_D.get(src)
+                return lsa is not None and lsa[0] > seq
+            return self.full_seq_D.get(i, 0) > seq
+        if self.routing_S == 'ls':
+            if src == self.name:
+                return True
+            # a copy may have come in another way, or a newer one with the
+            # same links
+            lsa = self.lsdb_D.get(src)
+            return lsa is not None and (lsa[0] >= seq or lsa[1] == {
+                nbr: cost for nbr, (intf, cost) in entries.items()})
+        # a delta is only accepted after the one before it, so an update
+        # accepted past a lost one is a full table
+        if self.rx_seq_D.get(src, 0) > seq:
+            return True
+        # a lost full table may have told us nothing new
+        row = self.rt_tbl.row_D.get(src)
+        return type_S == 'full' and row is not None and \
+            {dest: cost for dest, intf, cost in row.items()} == \
+            {dest: cost for dest, (intf, cost) in entries.items()}
+
+    # @return snapshot of the router and interface counters
+    def stats(self):
+        return {'data_forwarded': self.data_forwarded,
+                'data_dropped': self.data_dropped,
+                'control_sent': self.ctrl_sent,
+                'control_processed': self.ctrl_received,
+                'route_changes': self.route_changes,
+                'interfaces': [intf.stats() for intf in self.intf_L]}
+
     # look through the content of incoming interfaces and
     # process data and control packets
+    # @return number of packets processed
 
     def process_queues(self):
+        processed = 0
         for i in range(len(self.intf_L)):
             pkt_S = None
             # get packet from interface i
             pkt_S = self.intf_L[i].get('in')
             # if packet exists make a forwarding decision
             if pkt_S is not None:
-                p = NetworkPacket.from_byte_S(pkt_S)  # parse a packet out
+                processed += 1
+                p = NetworkPacket.from_wire(pkt_S)  # parse a packet out
                 if p.prot_S == 'data':
                     self.forward_packet(p, i)
                 elif p.prot_S == 'control':
-                    self.update_routes(p, i)
+                    changed_S = self.update_routes(p, i)
+                    if changed_S:
+                        self.last_change = self.clock()
+                        self.route_changes += len(changed_S)
+                    # counted only once any update it triggered is pending
+                    self.ctrl_received += 1
                 else:
                     raise Exception(
                         '%s: Unknown packet type in packet %s' % (self, p))
+        return processed
 
     # forward the packet according to the routing table
     #  @param p Packet to forward
     #  @param i Incoming interface number for packet p
 
     def forward_packet(self, p, i):
+        # the destination's column indexes the interfaces of our routes
+        c = self.rt_tbl.col_D.get(p.dst, INFINITY)
+        intf_A = self.my_routes.intf_A
+        out_intf = intf_A[c] if c < len(intf_A) else -1
+        if out_intf < 0:
+            self.data_dropped += 1
+            if router_log.warning:
+                router_log.log(netlog.WARNING, '%s: no route for packet "%s" from interface %d',
+                               self, p, i)
+            return
         try:
-            # TODO: Here you will need to implement a lookup into the
-            # forwarding table to find the appropriate outgoing interface
-            # for now we assume the outgoing interface is 1
-            #out_intf = self.cost_D[p.dst]
-            # print(out_intf)
-            intf = 0
-            routers = []
-            costs = []
-            i = 0
-            if p.dst not in self.cost_D:
-                for rtr in self.rt_tbl_D:
-                    if p.dst in self.rt_tbl_D[rtr]:
-                        routers[i] = rtr
-                        intf = list(self.rt_tbl_D[rtr][p.dst].keys())[0]
-                        costs[i] = self.rt_tbl_D[rtr][intf]
-                        i += 1
-                cheapest = costs.index(min(costs))
-                cheapest = routers[cheapest]
-                intf = list(self.rt_tbl_D[cheapest][p.dst].keys())[0]
-
-            else:
-                intf = list(self.cost_D[p.dst].keys())[0]
-
-            self.intf_L[int(intf)].put(p.to_byte_S(), 'out', True)
-            print('%s: forwarding packet "%s" from interface %d to %d' %
-                  (self, p, i, 1))
+            self.intf_L[out_intf].put(p.to_wire(), 'out', True)
+            self.data_forwarded += 1
+            if router_log.info:
+                router_log.log(netlog.INFO, '%s: forwarding packet "%s" from interface %d to %d',
+                               self, p, i, out_intf)
         except queue.Full:
-            print('%s: packet "%s" lost on interface %d' % (self, p, i))
+            self.data_dropped += 1
+            if router_log.warning:
+                router_log.log(netlog.WARNING, '%s: packet "%s" lost on interface %d',
+                               self, p, out_intf)
             pass
 
+    # @return the interface packets to dest leave on, None if there is no route
+    def next_hop(self, dest):
+        route = self.my_routes.get(self.rt_tbl.col_D.get(dest, INFINITY))
+        return None if route is None else route[0]
+
+    # forwarding table {destination: interface}, a copy built from our routes
+    @property
+    def fwd_D(self):
+        return {dest: intf for dest, intf, cost in self.my_routes.items()}
+
     # send out route update
     # @param i Interface number on which to send out a routing update
+    # @param full True to send the whole table instead of the changes since
+    #             the last update on this interface
 
-    def send_routes(self, i):
-        # TODO: Send out a routing table update
+    def send_routes(self, i, full=False):
         # create a routing table update packet
-        my_routes = {}
-        my_routes[self.name] = self.cost_D
-        p = NetworkPacket(0, 'control', json.dumps(my_routes))
+        if self.routing_S == 'ls':
+            p = self.make_lsa()
+        else:
+            p = self.make_routes(i, full)
+            if p is None:
+                return
+        self.advertised = True
+        self.send_control(p, i)
+
+    # create a distance vector update for one interface: the full table if
+    # asked for or if the neighbor never got one, otherwise the destinations
+    # changed since the last update (unreachable ones with cost INFINITY)
+    # @param i Interface number the update is for
+    # @param full True to send the whole table
+    # @return the update packet, or None if there is nothing new to send
+
+    def make_routes(self, i, full):
+        dirty_D = self.dirty_D.get(i)
+        if full or dirty_D is None:
+            type_S = 'full'
+            routes = self.my_routes.items()
+        elif dirty_D:
+            type_S = 'delta'
+            routes = []
+            for dest in dirty_D:
+                route = self.my_routes.get(self.rt_tbl.col(dest))
+                if route is None:
+                    routes.append((dest, -1, INFINITY))
+                else:
+                    routes.append((dest, route[0], route[1]))
+        else:
+            return None
+        self.dirty_D[i] = {}
+        seq = self.tx_seq_D.get(i, 0) + 1
+        self.tx_seq_D[i] = seq
+        if type_S == 'full':
+            self.full_seq_D[i] = seq
+        return NetworkPacket(0, 'control',
+                             encode_control(type_S, self.name, seq, routes))
+
+    # ask a neighbor for its full table after missing one of its updates
+    # @param i Interface number the neighbor is on
+
+    def request_routes(self, i):
+        self.send_control(NetworkPacket(
+            0, 'control', encode_control('request', self.name, 0, ())), i)
+
+    # put a control packet on an interface
+    # @param p Control packet to send
+    # @param i Interface number on which to send it
+
+    def send_control(self, p, i):
         try:
-            print('%s: sending routing update "%s" from interface %d' %
-                  (self, p, i))
-            self.intf_L[i].put(p.to_byte_S(), 'out', True)
+            if routing_log.info:
+                routing_log.log(netlog.INFO, '%s: sending routing update "%s" from interface %d',
+                                self, p, i)
+            self.intf_L[i].put(p.to_wire(), 'out', True)
+            self.ctrl_sent += 1
         except queue.Full:
-            print('%s: packet "%s" lost on interface %d' % (self, p, i))
+            if routing_log.warning:
+                routing_log.log(netlog.WARNING, '%s: packet "%s" lost on interface %d',
+                                self, p, i)
             pass
 
-    # forward the packet according to the routing table
+    # update the routing tables from a neighbor's distance vector
+    # and send out our own routes if they changed
     #  @param p Packet containing routing information
+    #  @param i Interface number the packet arrived on
+    #  @return set of destinations whose route changed
 
     def update_routes(self, p, i):
-        temp_cost_D = deepcopy(self.cost_D)
-        print('%s: Received routing update %s from interface %d' % (self, p, i))
-        routes = json.loads(p.data_S)
-        for key in routes:
-            updates = routes[key]
-            incoming_router = key
-            self.rt_tbl_D[key] = {}
-            self.rt_tbl_D[key] = routes[key]
-            self.rt_tbl_D[self.name] = {}
-        updated = False
-        for dest in updates:
-            # if destination does not exist in temp_cost_D
-            if dest not in temp_cost_D:
-                updated = True
-                intf = list(temp_cost_D[incoming_router].keys())[0]
-                cost = temp_cost_D[incoming_router][intf] + \
-                    updates[dest][list(updates[dest].keys())[0]]
-                temp_cost_D[dest] = {str(intf): cost}
-                self.rt_tbl_D[self.name][dest] = {str(intf): cost}
-
-            elif dest != self.name:
-                intf = list(temp_cost_D[dest].keys())[0]
-                self.rt_tbl_D[self.name][dest] = {
-                    str(intf): temp_cost_D[dest][intf]}
-                temp_cost_D[dest] = {str(intf): temp_cost_D[dest][intf]}
-
-            elif dest == self.name:
-                self.rt_tbl_D[self.name][self.name] = {'0': 0}
-                temp_cost_D[dest] = {'0': 0}
-
-            self.cost_D = temp_cost_D
+        if self.routing_S == 'ls':
+            return self.update_lsdb(p, i)
+        if routing_log.info:
+            routing_log.log(netlog.INFO, '%s: Received routing update %s from interface %d',
+                            self, p, i)
+        type_S, nbr, seq, routes = decode_control(p.data_B)
+        changed_S = set()
+        if nbr not in self.nbr_D:
+            if routing_log.warning:
+                routing_log.log(netlog.WARNING, '%s: ignoring routing update from non-neighbor %s',
+                                self, nbr)
+            return changed_S
+        if type_S == 'request':
+            self.send_routes(i, full=True)
+            return changed_S
+        if type_S == 'delta' and (nbr not in self.rt_tbl.row_D or
+                                  self.rx_seq_D[nbr] != seq - 1):
+            # a delta went missing: wait for a full table instead
+            if nbr not in self.resync_S:
+                if routing_log.warning:
+                    routing_log.log(netlog.WARNING,
+                                    '%s: lost routing update from %s, requesting full table',
+                                    self, nbr)
+                self.resync_S.add(nbr)
+                self.request_routes(i)
+            return changed_S
+        self.rx_seq_D[nbr] = seq
+        # update the neighbor's row and note which of its costs moved
+        old = self.rt_tbl.row_D.get(nbr)
+        if type_S == 'full':
+            self.resync_S.discard(nbr)
+            moved_L = [] if old is None else \
+                [c for c in old.order_A if old.name_L[c] not in routes]
+            row = self.rt_tbl.replace(nbr)
+        else:
+            moved_L = []
+            row = old
+        for dest, (intf, cost) in routes.items():
+            c = self.rt_tbl.col(dest)
+            old_cost = None if old is None else old.cost(c)
+            if cost >= INFINITY:
+                if old_cost is not None:
+                    moved_L.append(c)
+                row.remove(c)
+            else:
+                if old_cost != cost:
+                    moved_L.append(c)
+                row.set(c, intf, cost)
+        # Bellman-Ford only for the destinations whose advertised cost moved
+        for c in moved_L:
+            if self.relax(c):
+                changed_S.add(self.rt_tbl.name_L[c])
 
-        routers = []
-        for nbr in temp_cost_D:
-            if "R" in str(nbr):
-                routers.append(nbr)
+        if changed_S and routing_log.info:
+            routing_log.log(netlog.INFO, '%s: routes changed for %s',
+                            self, ', '.join(sorted(changed_S)))
+        if changed_S or not self.advertised:
+            self.schedule_update()
+        return changed_S
+
+    # arm the triggered update timer, unless an update is already pending
+
+    def schedule_update(self):
+        if self.update_due is not None:
+            return
+        due = self.clock() + self.update_window
+        if self.last_update is not None:
+            due = max(due, self.last_update + self.update_interval)
+        self.update_due = due
+
+    # send the pending triggered update to all neighboring routers if its
+    # timer has expired, and the periodic full table if that is due
+    #  @return seconds until the next update is due, or None if none is
 
-        if updated:
-            for router in routers:
-                if router != self.name:
-                    intf = list(self.cost_D[router].keys())[0]
-                    # send update to everyone except who updated you?
-                    self.send_routes(int(intf))
-        # TODO: add logic to update the routing tables and
-        # possibly send out routing updates
+    def flush_updates(self):
+        now = self.clock()
+        if self.update_due is not None and now >= self.update_due:
+            self.update_due = None
+            self.last_update = now
+            for intf in self.router_intf_L:
+                self.send_routes(intf)
+        if self.full_update_interval is not None and self.advertised:
+            if self.full_due is None:
+                self.full_due = now + self.full_update_interval
+            elif now >= self.full_due:
+                self.full_due = now + self.full_update_interval
+                if self.routing_S == 'ls':
+                    self.renumber_lsa()
+                for intf in self.router_intf_L:
+                    self.send_routes(intf, full=True)
+        due_L = [due for due in (self.update_due, self.full_due) if due is not None]
+        if not due_L:
+            return None
+        return max(min(due_L) - now, 0)
+
+    # recompute the best route to one destination over the direct link
+    # and the vectors advertised by our neighbors, updating our routes in
+    # place
+    #  @param c Column of the destination to recompute
+    #  @return True if the route to it changed
+
+    def relax(self, c):
+        dest = self.rt_tbl.name_L[c]
+        if dest == self.name:
+            return False
+        best_intf, best_cost = self.nbr_D.get(dest, (None, None))
+        for nbr, cost in self.rt_tbl.column(c):
+            intf, link_cost = self.nbr_D[nbr]
+            if best_cost is None or link_cost + cost < best_cost:
+                best_intf, best_cost = intf, link_cost + cost
+        route = self.my_routes.get(c)
+        if best_intf is None:
+            if route is None:
+                return False
+            self.my_routes.remove(c)
+        elif route == (best_intf, best_cost):
+            return False
+        else:
+            self.my_routes.set(c, best_intf, best_cost)
+        for dirty_D in self.dirty_D.values():
+            dirty_D[dest] = None
+        return True
+
+    # create a control packet carrying our link state advertisement:
+    # our adjacency stamped with the current sequence number
+
+    def make_lsa(self):
+        seq, links_D = self.lsdb_D[self.name]
+        links = [(nbr, -1, cost) for nbr, cost in links_D.items()]
+        return NetworkPacket(0, 'control',
+                             encode_control('lsa', self.name, seq, links))
+
+    # give our link state advertisement the next sequence number, so that
+    # the periodic refresh floods past the routers already holding it and
+    # reaches those that lost an earlier copy
+
+    def renumber_lsa(self):
+        self.lsa_seq += 1
+        self.lsdb_D[self.name] = (self.lsa_seq, self.lsdb_D[self.name][1])
+
+    # install a link state advertisement into the database, flood it on to
+    # the other routers and recompute shortest paths
+    #  @param p Packet containing the link state advertisement
+    #  @param i Interface number the packet arrived on
+    #  @return set of destinations whose route changed
+
+    def update_lsdb(self, p, i):
+        if routing_log.info:
+            routing_log.log(netlog.INFO, '%s: Received link state update %s from interface %d',
+                            self, p, i)
+        type_S, origin, seq, links = decode_control(p.data_B)
+        links_D = {nbr: cost for nbr, (intf, cost) in links.items()}
+        old = self.lsdb_D.get(origin)
+        # drop our own and already known advertisements so the flood stops
+        if origin == self.name or (old is not None and seq <= old[0]):
+            return set()
+        self.lsdb_D[origin] = (seq, links_D)
+        for intf in self.router_intf_L:
+            if intf != i:
+                self.send_control(p, intf)
+        # join the flood with our own advertisement
+        if not self.advertised:
+            for intf in self.router_intf_L:
+                self.send_routes(intf)
+        if old is None:
+            changed_S = self.incremental_spf(origin, links_D)
+        else:
+            # costs that only went down can be relaxed from the origin,
+            # anything else needs a full recomputation
+            old_links_D = old[1]
+            if all(nbr in links_D and links_D[nbr] <= cost
+                   for nbr, cost in old_links_D.items()):
+                changed_S = self.incremental_spf(origin, links_D)
+            else:
+                changed_S = self.run_spf()
+        if changed_S and routing_log.info:
+            routing_log.log(netlog.INFO, '%s: routes changed for %s',
+                            self, ', '.join(sorted(changed_S)))
+        return changed_S
+
+    # compute the shortest path tree over the link state database with
+    # Dijkstra's algorithm on a binary heap
+    #  @return set of destinations whose route changed
+
+    def run_spf(self):
+        spf_D = {}
+        heap = [(0, self.name, None)]
+        while heap:
+            cost, node, intf = heapq.heappop(heap)
+            if node in spf_D:
+                continue
+            spf_D[node] = (cost, intf)
+            lsa = self.lsdb_D.get(node)
+            if lsa is None:
+                continue
+            for nbr, link_cost in lsa[1].items():
+                if nbr not in spf_D:
+                    # the first hop is inherited from the path so far
+                    heapq.heappush(heap, (cost + link_cost, nbr,
+                                          self.nbr_D[nbr][0] if intf is None else intf))
+        changed_S = {node for node in spf_D if spf_D[node] != self.spf_D.get(node)}
+        changed_S.update(node for node in self.spf_D if node not in spf_D)
+        self.spf_D = spf_D
+        self.install_spf(changed_S)
+        return changed_S
+
+    # update the shortest path tree after the links of origin were added to
+    # or became cheaper, relaxing only the part of the tree they improve
+    #  @param origin Router whose advertisement changed
+    #  @param links_D Its new adjacency {neighbor: cost}
+    #  @return set of destinations whose route changed
+
+    def incremental_spf(self, origin, links_D):
+        spf_D = self.spf_D
+        if origin not in spf_D:
+            # origin is unreachable, so its links are on no path
+            return set()
+        base_cost, base_intf = spf_D[origin]
+        heap = []
+        for nbr, link_cost in links_D.items():
+            heapq.heappush(heap, (base_cost + link_cost, nbr,
+                                  self.nbr_D[nbr][0] if base_intf is None else base_intf))
+        changed_S = set()
+        while heap:
+            cost, node, intf = heapq.heappop(heap)
+            cur = spf_D.get(node)
+            if cur is not None and cur[0] <= cost:
+                continue
+            spf_D[node] = (cost, intf)
+            changed_S.add(node)
+            lsa = self.lsdb_D.get(node)
+            if lsa is None:
+                continue
+            for nbr, link_cost in lsa[1].items():
+                heapq.heappush(heap, (cost + link_cost, nbr, intf))
+        self.install_spf(changed_S)
+        return changed_S
+
+    # copy changed shortest paths into our routes
+    #  @param changed_S Destinations whose entry in spf_D changed
+
+    def install_spf(self, changed_S):
+        for dest in sorted(changed_S):
+            if dest == self.name:
+                continue
+            if dest in self.spf_D:
+                cost, intf = self.spf_D[dest]
+                self.my_routes.set(self.rt_tbl.col(dest), intf, cost)
+            else:
+                self.my_routes.remove(self.rt_tbl.col(dest))
 
     # thread target for the host to keep forwarding data
 
     def run(self):
-        print(threading.currentThread().getName() + ': Starting')
+        if thread_log.info:
+            thread_log.log(netlog.INFO, '%s: Starting', threading.current_thread().name)
+        timeout = None
         while True:
-            self.process_queues()
+            # block until a packet arrives, a triggered update is due
+            # or stop is set
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+            # keep sweeping the interfaces until they are all empty
+            while self.process_queues():
+                pass
+            timeout = self.flush_updates()
             if self.stop:
-                print(threading.currentThread().getName() + ': Ending')
+                if thread_log.info:
+                    thread_log.log(netlog.INFO, '%s: Ending', threading.current_thread().name)
                 return
+
+    # coroutine doing the job of run on an asyncio event loop, so that one
+    # thread can run thousands of routers
+    async def arun(self):
+        if thread_log.info:
+            thread_log.log(netlog.INFO, '%s: Starting', self)
+        await_packets(self)
+        loop = asyncio.get_running_loop()
+        timer = None
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            if timer is not None:
+                timer.cancel()
+            while self.process_queues():
+                pass
+            timeout = self.flush_updates()
+            if self.stop:
+                if thread_log.info:
+                    thread_log.log(netlog.INFO, '%s: Ending', self)
+                return
+            # come back when the next update is due
+            timer = None if timeout is None else \
+                loop.call_later(timeout, self.wakeup.set)
+
+
+# switch a node from its threading.Event to an asyncio.Event woken up by
+# packets arriving on its interfaces; set to begin with, in case packets
+# came in before the coroutine started
+def await_packets(node):
+    node.wakeup = asyncio.Event()
+    for intf in node.intf_L:
+        intf.in_ready = node.wakeup
+    node.wakeup.set()
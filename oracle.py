@@ -0,0 +1,184 @@
+try:
+    import numpy as np
+except ImportError:  # only needed when an oracle is computed
+    np = None
+
+# All-pairs shortest paths over the routers' cost_D tables, computed with
+# vectorized NumPy. It tells what every router's table should hold once
+# routing has converged, so it can check the tables the control plane came
+# up with, or fill them in right away without running the control plane at
+# all:
+#
+#   orc = oracle.Oracle({r.name: r.cost_D for r in router_L})
+#   assert not orc.check(router_L)
+#
+#   orc = oracle.Oracle(spec['routers'])  # see topology.read_spec
+#   orc.preload(router_L)
+#
+# Costs are directed: cost_D[nbr] is what the router pays to reach nbr.
+# Hosts are destinations only, packets never transit them. Of several
+# equally short paths the one leaving on the lowest interface is chosen;
+# the routers may pick another, which check accepts.
+#
+# The distances come from repeated min-plus products of the matrix with the
+# routers' links, one Bellman-Ford round per product, which costs
+# rounds * max degree * n^2 and needs as many rounds as the longest
+# shortest path has hops. Sparse networks of small diameter converge in a
+# few rounds; on long chains, once the rounds would cost more than all of
+# Floyd-Warshall (n^3), Floyd-Warshall finishes from where they stopped.
+
+
+class Oracle:
+
+    # @param cost_D_D: cost table of every router {router: cost_D}, with
+    #                  cost_D {neighbor: {interface: cost}}
+    def __init__(self, cost_D_D):
+        if np is None:
+            raise Exception('Oracle: numpy is needed to compute shortest paths')
+        self.cost_D_D = cost_D_D
+        # routers first, so the transit nodes are the leading rows
+        self.router_L = sorted(cost_D_D)
+        self.name_L = self.router_L + sorted(
+            {nbr for cost_D in cost_D_D.values() for nbr in cost_D} - set(cost_D_D))
+        self.index_D = {name: i for i, name in enumerate(self.name_L)}
+        # the links of every router by interface [[(interface, cost, neighbor index)]]
+        self.link_L_L = [sorted((int(intf), cost, self.index_D[nbr])
+                                for nbr, route in cost_D_D[name].items()
+                                for intf, cost in route.items())
+                         for name in self.router_L]
+        # single precision is exact for integer costs below 2^24 and twice as fast
+        bound = sum(max((cost for intf, cost, j in link_L), default=0) for link_L in self.link_L_L)
+        self.dtype = np.float32 if bound < 2 ** 24 else np.float64
+        self.dist = self.cost_matrix()
+        self.rounds = self.min_plus()
+        if self.rounds is None:
+            self.floyd_warshall()
+        self.next_hop = self.next_hops()
+
+    # called when printing the object
+    def __str__(self):
+        return 'Oracle'
+
+    # @return dense matrix of the direct link costs, inf where there is no
+    #         link and 0 on the diagonal
+    def cost_matrix(self):
+        n = len(self.name_L)
+        dist = np.full((n, n), np.inf, dtype=self.dtype)
+        np.fill_diagonal(dist, 0)
+        for i, link_L in enumerate(self.link_L_L):
+            for intf, cost, j in link_L:
+                dist[i, j] = min(dist[i, j], cost)
+        return dist
+
+    # Bellman-Ford on whole rows: every router's distances become the best
+    # of its links' costs plus the neighbor's distances, until nothing moves
+    # @return rounds run, None if they were given up for floyd_warshall
+    def min_plus(self):
+        router_count = len(self.router_L)
+        n = len(self.name_L)
+        degree = max(map(len, self.link_L_L), default=0)
+        if not degree:
+            return 0
+        # link slot s of every router: neighbor index and cost, padded with
+        # an infinite cost link to the router itself
+        nbr_A = np.tile(np.arange(router_count)[:, None], (1, degree))
+        cost_A = np.full((router_count, degree), np.inf, dtype=self.dtype)
+        for i, link_L in enumerate(self.link_L_L):
+            for s, (intf, cost, j) in enumerate(link_L):
+                nbr_A[i, s] = j
+                cost_A[i, s] = cost
+        dist = self.dist
+        tmp = np.empty((router_count, n), dtype=self.dtype)
+        for rounds in range(1, max(2, n // degree)):
+            new = dist[:router_count].copy()
+            for s in range(degree):
+                np.add(cost_A[:, s:s + 1], dist[nbr_A[:, s]], out=tmp)
+                np.minimum(new, tmp, out=new)
+            if np.array_equal(new, dist[:router_count]):
+                return rounds
+            dist[:router_count] = new
+        return None
+
+    # relax every path through each router in turn, a whole row of the
+    # matrix at a time; hosts are never a transit node
+    def floyd_warshall(self):
+        dist = self.dist
+        tmp = np.empty_like(dist)
+        for k in range(len(self.router_L)):
+            np.add(dist[:, k:k + 1], dist[k:k + 1, :], out=tmp)
+            np.minimum(dist, tmp, out=dist)
+
+    # @return matrix of the interface each router forwards on to each
+    #         destination, -1 for none; host rows are all -1
+    def next_hops(self):
+        n = len(self.name_L)
+        next_hop = np.full((len(self.router_L), n), -1, dtype=np.int32)
+        for i, link_L in enumerate(self.link_L_L):
+            row = next_hop[i]
+            target = self.dist[i]
+            reachable = np.isfinite(target)
+            for intf, cost, j in link_L:
+                # destinations the link to j starts a shortest path to;
+                # inf == inf would put unreachable ones on every link
+                on_path = (cost + self.dist[j] == target) & reachable & (row < 0)
+                row[on_path] = intf
+            row[i] = -1
+        return next_hop
+
+    # @return the shortest path cost from src to dest, None if unreachable
+    def cost(self, src, dest):
+        cost = self.dist[self.index_D[src], self.index_D[dest]]
+        return int(cost) if np.isfinite(cost) else None
+
+    # @return the routes of a router {destination: (cost, interface)}, the
+    #         same shape as Router.spf_D without the router itself
+    def routes(self, name):
+        i = self.index_D[name]
+        route_D = {}
+        for j in np.nonzero(self.next_hop[i] >= 0)[0]:
+            route_D[self.name_L[j]] = (int(self.dist[i, j]), int(self.next_hop[i, j]))
+        return route_D
+
+    # compare converged routers with the oracle
+    # @param router_L: Routers whose cost_D tables the oracle was built from
+    # @return list of (router, destination, expected (cost, interface) or
+    #         None, found (cost, interface) or None); a route on another
+    #         shortest path than the oracle's is not a mismatch
+    def check(self, router_L):
+        mismatch_L = []
+        for r in router_L:
+            route_D = self.routes(r.name)
+            found_D = {dest: (cost, intf) for dest, intf, cost in r.my_routes.items()}
+            for dest in sorted(set(route_D) | set(found_D)):
+                expected = route_D.get(dest)
+                found = found_D.get(dest)
+                if expected is None or found is None:
+                    if expected != found:
+                        mismatch_L.append((r.name, dest, expected, found))
+                elif found[0] != expected[0] or not self.on_path(r, dest, found[1]):
+                    mismatch_L.append((r.name, dest, expected, found))
+        return mismatch_L
+
+    # @return whether forwarding to dest on intf starts a shortest path
+    def on_path(self, r, dest, intf):
+        target = self.dist[self.index_D[r.name], self.index_D[dest]]
+        if not np.isfinite(target):
+            return False
+        for nbr, route in r.cost_D.items():
+            if intf in route:
+                via = self.dist[self.index_D[nbr], self.index_D[dest]]
+                return route[intf] + via == target
+        return False
+
+    # install the shortest paths into the routers' own routes (and
+    # shortest path trees, for link state), as if routing had converged
+    # @param router_L: Routers whose cost_D tables the oracle was built from
+    def preload(self, router_L):
+        for r in router_L:
+            route_D = self.routes(r.name)
+            r.my_routes.clear()
+            for dest, (cost, intf) in route_D.items():
+                r.my_routes.set(r.rt_tbl.col(dest), intf, cost)
+            if r.routing_S == 'ls':
+                r.spf_D = dict(route_D)
+                r.spf_D[r.name] = (0, None)
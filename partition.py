@@ -0,0 +1,441 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import netlog
+import network_3
+import link_3
+import convergence
+import topology
+
+# Runs a topology split into shards, each in its own worker process, so a
+# simulation is no longer held to one core by the GIL. Every worker builds
+# only its own Hosts, Routers and Links and runs them on an asyncio event
+# loop (see Router.arun). A link whose ends are in different shards is a
+# RemoteLink at each end: packets leaving it are encoded in the binary wire
+# format and shipped in batches through the other shard's multiprocessing
+# inbox. The parent process drives the workers through the same inboxes
+# and aggregates their control plane counters to detect convergence.
+#
+#   run = ShardedRun(topology.generate('grid', 1024), shards=8)
+#   run.start()
+#   run.wait_converged(60)
+#   run.udt_send('H0', 'H1', 'MESSAGE')
+#   run.stop()
+#
+# Run from the command line with --check, it also sends a packet between
+# every pair of hosts and fails unless all of them arrive:
+#
+#   python partition.py grid 64 --shards 2 --check
+
+
+# split a spec into shards of roughly equal numbers of routers, in
+# breadth-first order so that most links stay inside a shard; hosts go with
+# the router they are attached to
+# @return {node name: shard number}
+def partition(spec, shards):
+    router_D = spec['routers']
+    order_L = []
+    seen_S = set()
+    for root in router_D:
+        if root in seen_S:
+            continue
+        seen_S.add(root)
+        frontier_L = [root]
+        while frontier_L:
+            order_L.extend(frontier_L)
+            next_L = []
+            for name in frontier_L:
+                for nbr in router_D[name]:
+                    if nbr in router_D and nbr not in seen_S:
+                        seen_S.add(nbr)
+                        next_L.append(nbr)
+            frontier_L = next_L
+    shard_D = {name: i * shards // len(order_L) for i, name in enumerate(order_L)}
+    for node_1, intf_1, node_2, intf_2 in spec['links']:
+        if node_1 not in shard_D:
+            shard_D[node_1] = shard_D.get(node_2, 0)
+        if node_2 not in shard_D:
+            shard_D[node_2] = shard_D.get(node_1, 0)
+    for name in spec['hosts']:
+        shard_D.setdefault(name, 0)
+    return shard_D
+
+
+# one end of a link whose other end lives in another shard; it is the
+# out_ready listener of the local interface and ships what gets queued on it
+class RemoteLink:
+
+    # @param key: (link number, end) of the other end
+    # @param worker: the Worker owning the local end
+    def __init__(self, worker, node, intf, peer_shard, key):
+        self.worker = worker
+        self.node = node
+        self.intf = intf
+        self.peer_shard = peer_shard
+        self.key = key
+
+    # called when printing the object
+    def __str__(self):
+        return 'RemoteLink %s-%d - shard %d' % (self.node, self.intf, self.peer_shard)
+
+    def set(self):
+        self.worker.mark_ready(self)
+
+    # move everything queued on the local interface to the outbox
+    def drain(self, batch_L):
+        intf = self.node.intf_L[self.intf]
+        while True:
+            pkt = intf.get('out')
+            if pkt is None:
+                return
+            if not isinstance(pkt, bytes):
+                pkt = network_3.NetworkPacket.from_wire(pkt).to_bytes()
+            batch_L.append((self.key, pkt))
+
+
+# the part of a ShardedRun living in one worker process
+class Worker:
+
+    # @param shard: number of this shard
+    # @param shard_D: {node name: shard number}
+    # @param inbox_L: inbox of every shard
+    # @param result_q: queue for replies to the parent process
+    def __init__(self, spec, shard, shard_D, inbox_L, result_q, router_kw):
+        self.shard = shard
+        self.inbox_L = inbox_L
+        self.result_q = result_q
+        local_S = {name for name, num in shard_D.items() if num == shard}
+        local_spec = topology.new_spec([name for name in spec['hosts'] if name in local_S])
+        local_spec['routers'] = {name: cost_D for name, cost_D in spec['routers'].items()
+                                 if name in local_S}
+        local_spec['links'] = [link for link in spec['links']
+                               if link[0] in local_S and link[2] in local_S]
+        # cross-shard links are not modeled, they deliver as soon as the batch is shipped
+        local_spec['link_params'] = spec.get('link_params', {})
+        # the routers in the other shards count as routers here too
+        topology.register(spec)
+        # the spec was checked as a whole by ShardedRun
+        self.topo = topology.build(local_spec, intf_class=network_3.AsyncInterface,
+                                   check=False, **router_kw)
+        self.node_D = dict(self.topo.host_D)
+        self.node_D.update(self.topo.router_D)
+        # ends of the cross-shard links in this shard {(link number, end): (node, intf)}
+        self.remote_D = {}
+        self.remote_L = []
+        for num, (node_1, intf_1, node_2, intf_2) in enumerate(spec['links']):
+            for end, node, intf, peer, peer_intf in ((0, node_1, intf_1, node_2, intf_2),
+                                                     (1, node_2, intf_2, node_1, intf_1)):
+                if node in local_S and peer not in local_S:
+                    self.remote_D[(num, end)] = (self.node_D[node], intf)
+                    self.remote_L.append(RemoteLink(self, self.node_D[node], intf,
+                                                    shard_D[peer], (num, 1 - end)))
+        self.ready_D = {}  # remote links with packets to ship {RemoteLink: None}
+        self.received_D = dict.fromkeys(self.topo.host_D, 0)  # packets per host
+
+    # called when printing the object
+    def __str__(self):
+        return 'Worker %d' % self.shard
+
+    def mark_ready(self, remote_link):
+        if not self.ready_D:
+            self.loop.call_soon(self.flush)
+        self.ready_D[remote_link] = None
+
+    # ship what the remote links have queued, one batch per peer shard
+    def flush(self):
+        batch_D = {}
+        for remote_link in self.ready_D:
+            remote_link.drain(batch_D.setdefault(remote_link.peer_shard, []))
+        self.ready_D.clear()
+        for peer_shard, batch_L in batch_D.items():
+            if batch_L:
+                self.inbox_L[peer_shard].put(('packets', batch_L))
+
+    # put packets from other shards on the interfaces they arrived at
+    def deliver(self, batch_L):
+        for key, pkt in batch_L:
+            node, intf = self.remote_D[key]
+            if network_3.NetworkPacket.wire_format != 'binary':
+                pkt = network_3.NetworkPacket.from_bytes(pkt).to_wire()
+            try:
+                node.intf_L[intf].put(pkt, 'in')
+            except queue.Full:
+                node.intf_L[intf].count_lost(pkt)
+                if link_3.link_log.warning:
+                    link_3.link_log.log(netlog.WARNING, '%s: packet lost on interface %s-%d',
+                                        self, node, intf)
+
+    # receive on a host, counting the packets
+    def receive(self, host):
+        while host.udt_receive() is not None:
+            self.received_D[host.addr] += 1
+
+    # run a command from the parent process and send back its reply
+    def command(self, cmd_S, *arg_L):
+        reply = None
+        if cmd_S == 'start':
+            # every router starts advertising, as it would when the network boots
+            for router in self.topo.router_D.values():
+                for intf in router.router_intf_L:
+                    router.send_routes(intf)
+        elif cmd_S == 'send_routes':
+            self.node_D[arg_L[0]].send_routes(arg_L[1])
+        elif cmd_S == 'udt_send':
+            self.node_D[arg_L[0]].udt_send(arg_L[1], arg_L[2])
+        elif cmd_S == 'state':
+            reply = convergence.control_state(self.topo.router_D.values())
+        elif cmd_S == 'received':
+            reply = dict(self.received_D)
+        elif cmd_S == 'stats':
+            reply = self.topo.stats()
+        elif cmd_S == 'fwd':
+            reply = {name: dict(router.fwd_D) for name, router in self.topo.router_D.items()}
+        elif cmd_S == 'stop':
+            for obj in self.topo.object_L:
+                obj.stop = True
+        self.result_q.put((self.shard, cmd_S, reply))
+
+    # receiver thread: hands everything arriving in the inbox to the loop
+    def listen(self, inbox):
+        while True:
+            msg = inbox.get()
+            self.loop.call_soon_threadsafe(self.handle, msg)
+            if msg == ('command', ('stop',)):
+                return
+
+    def handle(self, msg):
+        kind_S, body = msg
+        if kind_S == 'packets':
+            self.deliver(body)
+        else:
+            self.command(*body)
+
+    async def arun(self, inbox):
+        self.loop = asyncio.get_running_loop()
+        for host in self.topo.host_D.values():
+            # hosts are served by the worker itself so it can count deliveries
+            host.intf_L[0].in_ready = HostReady(self, host)
+        task_L = [asyncio.create_task(obj.arun()) for obj in self.topo.object_L
+                  if not isinstance(obj, network_3.Host)]
+        await asyncio.sleep(0)
+        # the link layer only knows the local links, so the remote ends get
+        # their listeners after it has started
+        for remote_link in self.remote_L:
+            remote_link.node.intf_L[remote_link.intf].out_ready = remote_link
+            remote_link.set()
+        listener = threading.Thread(target=self.listen, args=(inbox,), daemon=True)
+        listener.start()
+        await asyncio.gather(*task_L)
+
+
+# in_ready listener of a host in a worker
+class HostReady:
+
+    def __init__(self, worker, host):
+        self.worker = worker
+        self.host = host
+        self.pending = False
+
+    def set(self):
+        if not self.pending:
+            self.pending = True
+            self.worker.loop.call_soon(self.fire)
+
+    def fire(self):
+        self.pending = False
+        self.worker.receive(self.host)
+
+
+# worker process target
+# @param quiet: only log warnings and errors
+def worker_main(spec, shard, shard_D, inbox_L, result_q, router_kw, quiet):
+    if quiet:
+        netlog.set_level(netlog.WARNING)
+    worker = Worker(spec, shard, shard_D, inbox_L, result_q, router_kw)
+    asyncio.run(worker.arun(inbox_L[shard]))
+
+
+# control plane counters of one shard, shaped like a Router for
+# ConvergenceMonitor
+class ShardCounters:
+
+    def __init__(self):
+        self.ctrl_sent = 0
+        self.ctrl_received = 0
+        self.ctrl_lost = 0
+        self.update_due = None
+        self.last_change = None
+        self.ctrl_unrepaired = 0
+        # monotonic time is system wide, so worker clocks agree with ours
+        self.clock = time.monotonic
+
+    def update(self, state):
+        self.ctrl_sent, self.ctrl_received, self.ctrl_lost, pending, \
+            self.last_change, self.ctrl_unrepaired = state
+        self.update_due = 0 if pending else None
+
+    def control_lost(self):
+        return self.ctrl_lost
+
+    def control_unrepaired(self):
+        return self.ctrl_unrepaired
+
+
+class ShardedRun:
+
+    # @param spec: topology spec, see topology.read_spec
+    # @param shards: number of worker processes
+    # @param quiet: only log warnings and errors in the workers
+    # @param router_kw: keyword arguments passed to every Router
+    def __init__(self, spec, shards=None, quiet=True, **router_kw):
+        topology.check_spec(spec)
+        self.spec = spec
+        self.shards = shards or os.cpu_count()
+        self.shard_D = partition(spec, self.shards)
+        self.quiet = quiet
+        self.router_kw = router_kw
+        self.counter_L = [ShardCounters() for _ in range(self.shards)]
+        self.monitor = None
+        self.process_L = []
+
+    # called when printing the object
+    def __str__(self):
+        return 'ShardedRun'
+
+    # start the workers and have every router advertise its routes
+    def start(self):
+        self.inbox_L = [multiprocessing.Queue() for _ in range(self.shards)]
+        self.result_q = multiprocessing.Queue()
+        for shard in range(self.shards):
+            p = multiprocessing.Process(target=worker_main, name='shard-%d' % shard,
+                                        args=(self.spec, shard, self.shard_D, self.inbox_L,
+                                              self.result_q, self.router_kw, self.quiet))
+            p.start()
+            self.process_L.append(p)
+        self.monitor = convergence.ConvergenceMonitor(self.counter_L)
+        self.broadcast('start')
+
+    # run a command in the given shards, all of them by default
+    # @return {shard: reply}
+    def broadcast(self, *cmd, shard_L=None):
+        if shard_L is None:
+            shard_L = range(self.shards)
+        for shard in shard_L:
+            self.inbox_L[shard].put(('command', cmd))
+        reply_D = {}
+        while len(reply_D) < len(shard_L):
+            shard, cmd_S, reply = self.result_q.get()
+            reply_D[shard] = reply
+        return reply_D
+
+    # run a command in the shard owning a node
+    def command(self, name, *cmd):
+        shard = self.shard_D[name]
+        return self.broadcast(*cmd, shard_L=[shard])[shard]
+
+    # block until the routing tables have converged in all shards
+    # @param timeout: seconds to give up after, None to wait forever
+    # @return True if converged, False on timeout
+    def wait_converged(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            for shard, state in self.broadcast('state').items():
+                self.counter_L[shard].update(state)
+            if self.monitor.check():
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.monitor.poll_interval)
+
+    def send_routes(self, router, intf):
+        self.command(router, 'send_routes', router, intf)
+
+    def udt_send(self, host, dst, data_S):
+        self.command(host, 'udt_send', host, dst, data_S)
+
+    # @return {host: packets received}
+    def received(self):
+        received_D = {}
+        for reply in self.broadcast('received').values():
+            received_D.update(reply)
+        return received_D
+
+    # @return counters of all shards, shaped like topology.Topology.stats;
+    #         links crossing shards are left out, their interfaces are not
+    def stats(self):
+        stats_D = {'hosts': {}, 'routers': {}, 'links': {}}
+        for reply in self.broadcast('stats').values():
+            for kind_S, part_D in reply.items():
+                stats_D[kind_S].update(part_D)
+        return stats_D
+
+    # @return forwarding tables {router: {destination: interface}}
+    def forwarding_tables(self):
+        fwd_D = {}
+        for reply in self.broadcast('fwd').values():
+            fwd_D.update(reply)
+        return fwd_D
+
+    # stop the workers and wait for them to exit
+    def stop(self):
+        self.broadcast('stop')
+        for p in self.process_L:
+            p.join()
+        self.process_L = []
+
+
+# end to end check of a converged run: send a packet between every ordered
+# pair of hosts and wait for them to arrive
+# @param timeout: seconds to wait for the packets
+# @return number of packets that did not arrive
+def check_delivery(run, timeout):
+    host_L = sorted(run.spec['hosts'])
+    for src in host_L:
+        for dst in host_L:
+            if src != dst:
+                run.udt_send(src, dst, 'CHECK_FROM_%s' % src)
+    expected = len(host_L) * (len(host_L) - 1)
+    deadline = time.monotonic() + timeout
+    while True:
+        missing = expected - sum(run.received().values())
+        if not missing or time.monotonic() >= deadline:
+            return missing
+        time.sleep(0.01)
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='run a generated topology in shards')
+    parser.add_argument('kind', choices=sorted(topology.generator_D))
+    parser.add_argument('size', type=int)
+    parser.add_argument('--shards', type=int, default=os.cpu_count())
+    parser.add_argument('--routing', default='dv', choices=['dv', 'ls'])
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='seconds to wait for convergence and for the check')
+    parser.add_argument('--check', action='store_true',
+                        help='then send a packet between every pair of hosts and '
+                             'exit with an error unless the run converged and all arrived')
+    args = parser.parse_args()
+    run = ShardedRun(topology.generate(args.kind, args.size), args.shards,
+                     routing_S=args.routing)
+    start = time.monotonic()
+    failed = False
+    # the workers are not daemons, so they must be stopped whatever happens
+    try:
+        run.start()
+        converged = run.wait_converged(args.timeout)
+        print('%d shards: %s in %.3fs wall time' %
+              (args.shards, run.monitor, time.monotonic() - start))
+        if args.check:
+            missing = check_delivery(run, args.timeout or 10.0)
+            print('%d packets missing' % missing)
+            failed = not converged or missing > 0
+    finally:
+        run.stop()
+    if failed:
+        sys.exit(1)
@@ -1,63 +1,92 @@
 import network_3
-import link_3
+import event_sim
+import convergence
+import topology
 import threading
+import asyncio
 from time import sleep
 import sys
 
 ##configuration parameters
 router_queue_size = 0 #0 means unlimited
-simulation_time = 3   #give the network sufficient time to execute transfers
-
-if __name__ == '__main__':
-    object_L = [] #keeps track of objects, so we can kill their threads at the end
-
-    #create network hosts
-    host_1 = network_3.Host('H1')
-    object_L.append(host_1)
-    host_2 = network_3.Host('H2')
-    object_L.append(host_2)
-
-    #create routers and cost tables for reaching neighbors
-    cost_D = {'H1': {0: 3}, 'RB': {1: 1}, 'RC': {2: 1}} # {neighbor: {interface: cost}}
-    router_a = network_3.Router(name='RA',
-                              cost_D = cost_D,
-                              max_queue_size=router_queue_size)
-    object_L.append(router_a)
-
-    cost_D = {'RD': {1: 1}, 'RA': {0: 1}} # {neighbor: {interface: cost}}
-    router_b = network_3.Router(name='RB',
-                              cost_D = cost_D,
-                              max_queue_size=router_queue_size)
-    object_L.append(router_b)
-
-    cost_D = {'RD': {1: 3}, 'RA': {0: 1}} # {neighbor: {interface: cost}}
-    router_c = network_3.Router(name='RC',
-                              cost_D = cost_D,
-                              max_queue_size=router_queue_size)
-    object_L.append(router_c)
-
-    cost_D = {'H2': {2: 3}, 'RB': {1: 2}, 'RC': {0: 1}} # {neighbor: {interface: cost}}
-    router_d = network_3.Router(name='RD',
-                              cost_D = cost_D,
-                              max_queue_size=router_queue_size)
-    object_L.append(router_d)
-
-    #create a Link Layer to keep track of links between network nodes
-    link_layer = link_3.LinkLayer()
-    object_L.append(link_layer)
-
-    #add all the links - need to reflect the connectivity in cost_D tables above
-    link_layer.add_link(link_3.Link(host_1, 0, router_a, 0))
+simulation_time = 3   #upper bound on convergence time, and time given to execute transfers
+routing = 'dv'        #'dv' for distance vector, 'ls' for link state
+engine = 'events'     #'events' for the discrete-event simulator, 'threads' for one thread per object, 'asyncio' for one event loop
+seed = 0              #seed for the discrete-event simulator
+link_workers = 2      #threads the link layer runs the links on
+link_batch = 8        #most packets a link moves per direction at once
+
+#same steps as the threaded simulation below, with coroutines on one event loop
+async def run_asyncio(object_L, host_1, host_2, router_a):
+    #start all the objects
+    task_L = [asyncio.create_task(obj.arun()) for obj in object_L]
+    await asyncio.sleep(0)
 
-    link_layer.add_link(link_3.Link(router_a, 1, router_b, 0))
-    link_layer.add_link(link_3.Link(router_a, 2, router_c, 0))
+    ## compute routing tables
+    monitor = convergence.ConvergenceMonitor(
+        [obj for obj in object_L if isinstance(obj, network_3.Router)])
+    router_a.send_routes(1) #one update starts the routing process
+    await monitor.wait_async(simulation_time)  #let the tables converge
+    print("Converged routing tables: %s" % monitor)
+    for obj in object_L:
+        if str(type(obj)) == "<class 'network_3.Router'>":
+            obj.print_routes()
 
-    link_layer.add_link(link_3.Link(router_b, 1, router_d, 0))
+    #send packet from host 1 to host 2
+    host_1.udt_send('H2', 'MESSAGE_FROM_H1')
+    await asyncio.sleep(1)
+    host_2.udt_send('H1', "REPLY_FROM_H2")
+    await asyncio.sleep(1)
 
-    link_layer.add_link(link_3.Link(router_c, 1, router_d, 1))
+    #wait for all the coroutines to end
+    for o in object_L:
+        o.stop = True
+    await asyncio.gather(*task_L)
+    print("All simulation coroutines ended")
 
-    link_layer.add_link(link_3.Link(router_d, 2, host_2, 0))
 
+if __name__ == '__main__':
+    #build the hosts, routers and links described in the topology file
+    topo = topology.load('simulation_3.topo', max_queue_size=router_queue_size,
+                         verbose=True, routing_S=routing,
+                         link_workers=link_workers, link_batch=link_batch,
+                         intf_class=network_3.AsyncInterface if engine == 'asyncio' else network_3.Interface)
+    object_L = topo.object_L #keeps track of objects, so we can kill their threads at the end
+    host_1 = topo.host_D['H1']
+    host_2 = topo.host_D['H2']
+    router_a = topo.router_D['RA']
+
+
+    if engine == 'asyncio':
+        asyncio.run(run_asyncio(object_L, host_1, host_2, router_a))
+        sys.exit()
+
+    if engine == 'events':
+        #drive all the objects from one virtual clock
+        sim = event_sim.Simulator(seed=seed)
+        for obj in object_L:
+            sim.add(obj)
+
+        ## compute routing tables
+        monitor = convergence.ConvergenceMonitor(
+            [obj for obj in object_L if isinstance(obj, network_3.Router)],
+            settle_time=0)
+        sim.schedule(0, router_a.send_routes, 1) #one update starts the routing process
+        sim.run() #runs until the tables have converged
+        monitor.check()
+        print("Converged routing tables: %s" % monitor)
+        for obj in object_L:
+            if str(type(obj)) == "<class 'network_3.Router'>":
+                obj.print_routes()
+
+        #send packet from host 1 to host 2
+        sim.schedule(0, host_1.udt_send, 'H2', 'MESSAGE_FROM_H1')
+        sim.run()
+        sim.schedule(0, host_2.udt_send, 'H1', "REPLY_FROM_H2")
+        sim.run()
+
+        print("Simulation finished at %.3fs" % sim.now)
+        sys.exit()
 
     #start all the objects
     thread_L = []
@@ -68,9 +97,11 @@ if __name__ == '__main__':
         t.start()
 
     ## compute routing tables
+    monitor = convergence.ConvergenceMonitor(
+        [obj for obj in object_L if isinstance(obj, network_3.Router)])
     router_a.send_routes(1) #one update starts the routing process
-    sleep(simulation_time)  #let the tables converge
-    print("Converged routing tables")
+    monitor.wait(simulation_time)  #let the tables converge
+    print("Converged routing tables: %s" % monitor)
     for obj in object_L:
         if str(type(obj)) == "<class 'network_3.Router'>":
             obj.print_routes()
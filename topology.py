@@ -0,0 +1,419 @@
+import gc
+import json
+import math
+import random
+
+import network_3
+import link_3
+
+# Builds Hosts, Routers and the LinkLayer connecting them from a topology
+# file instead of hand-written cost_D tables and Link calls. Two formats are
+# read:
+#
+# JSON, with the hosts, the links and optionally the routers' cost tables:
+#   {"hosts": ["H1", "H2"],
+#    "links": [["H1", 0, "RA", 0, 3], ["RA", 1, "RB", 0, 1, 2, {"delay": 0.02}], ...],
+#    "routers": {"RA": {"H1": {"0": 3}, "RB": {"1": 1}}, ...}}
+#
+# edge list, one link per line, with # comments and host declarations:
+#   host H1 H2
+#   H1 0 RA 0 3
+#   RA 1 RB 0 1 2 delay=0.02
+#
+# A link is node_1 intf_1 node_2 intf_2 followed by the cost node_1 pays to
+# reach node_2 and the cost node_2 pays to reach node_1 (the same as the
+# first if left out). Every node that is not declared a host is a router.
+# Cost tables given in the JSON must agree with the links. A link may end
+# with its physical properties, passed to link_3.Link: bandwidth (bits per
+# second), delay (seconds), loss (probability) and burst (bits).
+
+
+class Topology:
+
+    # @param link_workers, link_batch: passed to the LinkLayer
+    def __init__(self, link_workers=1, link_batch=1):
+        self.host_D = {}  # {name: Host}
+        self.router_D = {}  # {name: Router}
+        self.link_layer = link_3.LinkLayer(link_workers, link_batch)
+        # everything with a thread target, in the order simulations use
+        self.object_L = []
+
+    # called when printing the object
+    def __str__(self):
+        return 'Topology'
+
+    # @return snapshot of every counter {'hosts': {name: stats},
+    #         'routers': {name: stats}, 'links': {link name: stats}}
+    def stats(self):
+        return {'hosts': {name: host.stats() for name, host in self.host_D.items()},
+                'routers': {name: router.stats() for name, router in self.router_D.items()},
+                'links': {str(link): link.stats() for link in self.link_layer.link_L}}
+
+    # the interfaces whose queues got deepest, to find bottlenecks
+    # @param count: how many to return
+    # @param hosts: False to leave out the hosts, whose queues are where
+    #               the traffic starts and ends rather than crosses the network
+    # @return [(high water mark, node name, interface, 'in' or 'out')], deepest first
+    def bottlenecks(self, count=10, hosts=True):
+        mark_L = []
+        node_L = list(self.host_D.items()) if hosts else []
+        for name, node in node_L + list(self.router_D.items()):
+            for intf_num, intf in enumerate(node.intf_L):
+                mark_L.append((intf.in_high_water, name, intf_num, 'in'))
+                mark_L.append((intf.out_high_water, name, intf_num, 'out'))
+        mark_L.sort(key=lambda mark: mark[0], reverse=True)
+        return mark_L[:count]
+
+
+# read a topology file, JSON if it ends in .json, an edge list otherwise
+# @param path: file to read
+# @return spec {'hosts': [name], 'routers': {name: cost_D},
+#               'links': [(node_1, intf_1, node_2, intf_2)],
+#               'link_params': {link: {property: value}}}
+def read_spec(path):
+    with open(path) as f:
+        text_S = f.read()
+    if path.endswith('.json'):
+        return parse_json(text_S)
+    return parse_edge_list(text_S)
+
+
+def parse_json(text_S):
+    doc_D = json.loads(text_S)
+    spec = new_spec(doc_D.get('hosts', []))
+    # interface numbers are strings in JSON object keys
+    for name, cost_D in doc_D.get('routers', {}).items():
+        spec['routers'][name] = {nbr: {int(intf): cost for intf, cost in route.items()}
+                                 for nbr, route in cost_D.items()}
+    return fill_costs(spec, doc_D.get('links', []))
+
+
+def parse_edge_list(text_S):
+    spec = new_spec([])
+    link_L = []
+    for line_num, line_S in enumerate(text_S.splitlines(), 1):
+        field_L = line_S.split('#', 1)[0].split()
+        if not field_L:
+            continue
+        if field_L[0] == 'host':
+            spec['hosts'].extend(field_L[1:])
+            continue
+        param_D = {}
+        while field_L and '=' in field_L[-1]:
+            name, value_S = field_L.pop().split('=', 1)
+            try:
+                param_D[name] = float(value_S)
+            except ValueError:
+                raise Exception('Topology: line %d: %s must be a number: %s' %
+                                (line_num, name, line_S))
+        if len(field_L) not in (5, 6):
+            raise Exception('Topology: line %d: expected node intf node intf cost [cost]: %s' %
+                            (line_num, line_S))
+        try:
+            node_1, intf_1, node_2, intf_2 = field_L[0], int(
+                field_L[1]), field_L[2], int(field_L[3])
+            cost_L = [int(cost_S) for cost_S in field_L[4:]]
+        except ValueError:
+            raise Exception('Topology: line %d: interfaces and costs must be integers: %s' %
+                            (line_num, line_S))
+        link_L.append((node_1, intf_1, node_2, intf_2) + tuple(cost_L) +
+                      ((param_D,) if param_D else ()))
+    return fill_costs(spec, link_L)
+
+
+def new_spec(host_L):
+    # link_costs holds the cost given on the links {(node, interface): cost}
+    return {'hosts': list(host_L), 'routers': {}, 'links': [], 'link_costs': {},
+            'link_params': {}}
+
+
+# properties a link may be given, see link_3.Link
+link_param_S = {'bandwidth', 'delay', 'loss', 'burst'}
+
+
+# fill in the cost tables of the routers that were not given one from the
+# costs on their links, once all hosts are known
+def fill_costs(spec, link_L):
+    host_S = set(spec['hosts'])
+    given_S = set(spec['routers'])
+    link_cost_D = spec['link_costs']
+    for link in link_L:
+        param_D = None
+        if link and isinstance(link[-1], dict):
+            param_D = link[-1]
+            link = link[:-1]
+        if len(link) not in (4, 5, 6):
+            raise Exception('Topology: bad link %s' % (link,))
+        node_1, intf_1, node_2, intf_2 = link[:4]
+        cost_L = list(link[4:])
+        spec['links'].append((node_1, intf_1, node_2, intf_2))
+        if param_D:
+            unknown_S = set(param_D) - link_param_S
+            if unknown_S:
+                raise Exception('Topology: link %s-%d - %s-%d: unknown properties %s' %
+                                (node_1, intf_1, node_2, intf_2, sorted(unknown_S)))
+            spec['link_params'][(node_1, intf_1, node_2, intf_2)] = dict(param_D)
+        if cost_L:
+            link_cost_D[(node_1, intf_1)] = cost_L[0]
+            link_cost_D[(node_2, intf_2)] = cost_L[-1]
+        for node, intf, other in ((node_1, intf_1, node_2), (node_2, intf_2, node_1)):
+            if node in host_S or node in given_S:
+                continue
+            if not cost_L:
+                raise Exception('Topology: link %s-%d - %s-%d has no cost' %
+                                (node_1, intf_1, node_2, intf_2))
+            spec['routers'].setdefault(node, {})[other] = {
+                intf: link_cost_D[(node, intf)]}
+    return spec
+
+
+# check that the links and cost tables describe the same network
+# @raise Exception describing the first inconsistency found
+def check_spec(spec):
+    host_S = set(spec['hosts'])
+    router_D = spec['routers']
+    if len(host_S) != len(spec['hosts']):
+        raise Exception('Topology: duplicate host names')
+    for name in host_S & set(router_D):
+        raise Exception('Topology: %s is declared both a host and a router' % name)
+    max_length = network_3.NetworkPacket.dst_S_length
+    for name in list(host_S) + list(router_D):
+        if len(name) > max_length:
+            raise Exception('Topology: node name %s is longer than %d characters' %
+                            (name, max_length))
+    link_cost_D = spec.get('link_costs', {})
+    used_D = {}  # {(node, interface): node at the other end}
+    for node_1, intf_1, node_2, intf_2 in spec['links']:
+        for node, intf, other, other_intf in ((node_1, intf_1, node_2, intf_2),
+                                              (node_2, intf_2, node_1, intf_1)):
+            if node not in host_S and node not in router_D:
+                raise Exception('Topology: link to unknown node %s' % node)
+            if (node, intf) in used_D:
+                raise Exception('Topology: interface %s-%d is used by two links' %
+                                (node, intf))
+            used_D[(node, intf)] = other
+            if node in host_S:
+                if intf != 0:
+                    raise Exception('Topology: host %s only has interface 0, not %d' %
+                                    (node, intf))
+                continue
+            route = router_D[node].get(other)
+            if route is None or intf not in route:
+                raise Exception('Topology: %s has no cost for reaching %s on interface %d' %
+                                (node, other, intf))
+            if (node, intf) in link_cost_D and route[intf] != link_cost_D[(node, intf)]:
+                raise Exception('Topology: %s costs %s on interface %d but the link says %s' %
+                                (node, route[intf], intf, link_cost_D[(node, intf)]))
+    for name, cost_D in router_D.items():
+        intf_L = []
+        for nbr, route in cost_D.items():
+            if len(route) != 1:
+                raise Exception('Topology: %s reaches %s on more than one interface' %
+                                (name, nbr))
+            for intf in route:
+                if used_D.get((name, intf)) != nbr:
+                    raise Exception('Topology: %s has no link to %s on interface %d' %
+                                    (name, nbr, intf))
+                intf_L.append(intf)
+        # routers create interfaces 0 .. len(cost_D)-1
+        if sorted(intf_L) != list(range(len(intf_L))):
+            raise Exception('Topology: %s interfaces are not numbered 0 to %d: %s' %
+                            (name, len(intf_L) - 1, sorted(intf_L)))
+
+
+# create the Hosts, Routers and Links of a checked spec
+# @param max_queue_size: max queue length of the router interfaces
+# @param verbose: print every object and routing table as it is created
+# @param intf_class: network_3.Interface, or AsyncInterface to run with arun
+# @param check: run check_spec first; a part of a spec checked as a whole
+#               would fail it for the links leading out of the part
+# @param router_intf_class: interface class of the routers if not intf_class,
+#                           e.g. network_3.RingInterface
+# @param link_workers: threads the LinkLayer runs the links on
+# @param link_batch: most packets a link moves per direction in one sweep
+# @param link_kw: properties of the links that the spec does not set, e.g.
+#                 {'bandwidth': 1e6}, and a seed for their losses
+# @param router_kw: other keyword arguments passed to every Router
+# @return Topology
+def build(spec, max_queue_size=0, verbose=False, intf_class=network_3.Interface,
+          check=True, router_intf_class=None, link_workers=1, link_batch=1,
+          link_kw=None, **router_kw):
+    if check:
+        check_spec(spec)
+    topo = Topology(link_workers, link_batch)
+    register(spec)
+    # the collector would walk the whole graph again and again as it grows
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for name in spec['hosts']:
+            topo.host_D[name] = network_3.Host(name, intf_class)
+        for name, cost_D in spec['routers'].items():
+            topo.router_D[name] = network_3.Router(name, cost_D, max_queue_size,
+                                                   verbose=verbose,
+                                                   intf_class=router_intf_class or intf_class,
+                                                   **router_kw)
+        node_D = dict(topo.host_D)
+        node_D.update(topo.router_D)
+        link_param_D = spec.get('link_params', {})
+        for link in spec['links']:
+            node_1, intf_1, node_2, intf_2 = link
+            param_D = dict(link_kw or {})
+            param_D.update(link_param_D.get(link, {}))
+            if 'seed' in param_D:
+                # a different but repeatable stream of losses on every link
+                param_D['seed'] = '%s-%s' % (param_D['seed'], len(topo.link_layer.link_L))
+            topo.link_layer.add_link(link_3.Link(node_D[node_1], intf_1,
+                                                 node_D[node_2], intf_2, verbose=verbose,
+                                                 **param_D))
+    finally:
+        if gc_enabled:
+            gc.enable()
+    topo.object_L = list(topo.host_D.values()) + list(topo.router_D.values()) + \
+        [topo.link_layer]
+    return topo
+
+
+# tell the node registry the kind of every node of a spec, so routers know
+# which neighbors are routers before those are built; this only adds a
+# NodeInfo per node, routing tables do not grow with the number of nodes
+# registered
+def register(spec):
+    for name in spec['hosts']:
+        network_3.registry.register(name, 'host')
+    for name in spec['routers']:
+        network_3.registry.register(name, 'router')
+
+
+# read and build a topology file
+# @param path: JSON (.json) or edge list file
+# @return Topology
+def load(path, max_queue_size=0, verbose=False, intf_class=network_3.Interface,
+         link_workers=1, link_batch=1, link_kw=None, **router_kw):
+    return build(read_spec(path), max_queue_size, verbose, intf_class,
+                 link_workers=link_workers, link_batch=link_batch, link_kw=link_kw,
+                 **router_kw)
+
+
+# Synthetic topologies. Each generator returns the router to router links as
+# [(router_1, router_2, cost)] and the routers hosts may attach to, ordered
+# so that picking them evenly spaced, first and last included, spreads the
+# hosts out. Routers are
+# numbered R0, R1, ... and hosts H0, H1, ...
+
+def router_name(num):
+    return 'R%d' % num
+
+
+def line(n, cost=1):
+    edge_L = [(router_name(i), router_name(i + 1), cost) for i in range(n - 1)]
+    return edge_L, [router_name(i) for i in range(n)]
+
+
+def ring(n, cost=1):
+    edge_L, edge_router_L = line(n, cost)
+    if n > 2:
+        edge_L.append((router_name(n - 1), router_name(0), cost))
+    # the first and last of one half of the ring are furthest apart
+    return edge_L, edge_router_L[:n // 2 + 1]
+
+
+def grid(rows, cols, cost=1):
+    edge_L = []
+    for y in range(rows):
+        for x in range(cols):
+            num = y * cols + x
+            if x + 1 < cols:
+                edge_L.append((router_name(num), router_name(num + 1), cost))
+            if y + 1 < rows:
+                edge_L.append((router_name(num), router_name(num + cols), cost))
+    return edge_L, [router_name(i) for i in range(rows * cols)]
+
+
+# connected random graph: a random spanning tree plus random extra links
+# until the mean degree is reached
+# @param max_cost: costs are drawn uniformly from 1 .. max_cost
+def random_graph(n, degree=3, seed=None, max_cost=1):
+    rng = random.Random(seed)
+    pair_S = set()
+    edge_L = []
+
+    def connect(a, b):
+        pair = (min(a, b), max(a, b))
+        if a == b or pair in pair_S:
+            return
+        pair_S.add(pair)
+        edge_L.append((router_name(pair[0]), router_name(pair[1]),
+                       rng.randint(1, max_cost)))
+    for i in range(1, n):
+        connect(i, rng.randrange(i))
+    target = min(n * degree // 2, n * (n - 1) // 2)
+    while len(edge_L) < target:
+        connect(rng.randrange(n), rng.randrange(n))
+    return edge_L, [router_name(i) for i in range(n)]
+
+
+# k-ary fat tree: (k/2)^2 core routers and k pods of k/2 aggregation and
+# k/2 edge routers, 5k^2/4 routers in all; hosts attach to edge routers
+def fat_tree(k, cost=1):
+    if k < 2 or k % 2:
+        raise Exception('Topology: fat tree k must be even, not %d' % k)
+    half = k // 2
+    core_L = [router_name(i) for i in range(half * half)]
+    num = len(core_L)
+    edge_L = []
+    edge_router_L = []
+    for pod in range(k):
+        agg_L = [router_name(num + i) for i in range(half)]
+        pod_edge_L = [router_name(num + half + i) for i in range(half)]
+        num += k
+        for i, agg in enumerate(agg_L):
+            for core in core_L[i * half:(i + 1) * half]:
+                edge_L.append((agg, core, cost))
+            for edge in pod_edge_L:
+                edge_L.append((agg, edge, cost))
+        edge_router_L.extend(pod_edge_L)
+    return edge_L, edge_router_L
+
+
+# generators by name, each taking a rough number of routers
+generator_D = {
+    'line': lambda size, seed: line(size),
+    'ring': lambda size, seed: ring(size),
+    'grid': lambda size, seed: grid(max(1, math.isqrt(size)), max(1, math.isqrt(size))),
+    'random': lambda size, seed: random_graph(size, seed=seed, max_cost=10),
+    # largest fat tree with at most size routers
+    'fat-tree': lambda size, seed: fat_tree(max(2, 2 * math.isqrt(max(1, 4 * size // 5) // 4))),
+}
+
+
+# make a spec from router links, numbering interfaces in link order
+# @param host_count: hosts to attach, evenly spaced over edge_router_L
+# @param host_cost: cost of the host links
+def make_spec(edge_L, edge_router_L, host_count=2, host_cost=1):
+    next_intf_D = {}
+
+    def next_intf(node):
+        intf = next_intf_D.get(node, 0)
+        next_intf_D[node] = intf + 1
+        return intf
+    spec = new_spec([])
+    link_L = [(a, next_intf(a), b, next_intf(b), cost) for a, b, cost in edge_L]
+    host_count = min(host_count, len(edge_router_L))
+    for i in range(host_count):
+        host = 'H%d' % i
+        router = edge_router_L[i * (len(edge_router_L) - 1) // max(1, host_count - 1)]
+        spec['hosts'].append(host)
+        link_L.append((host, 0, router, next_intf(router), host_cost))
+    return fill_costs(spec, link_L)
+
+
+# generate a synthetic topology spec
+# @param kind_S: one of generator_D
+# @param size: rough number of routers
+# @param seed: seed for the random graph
+def generate(kind_S, size, host_count=2, seed=None):
+    if kind_S not in generator_D:
+        raise Exception('Topology: unknown topology kind %s' % kind_S)
+    edge_L, edge_router_L = generator_D[kind_S](size, seed)
+    return make_spec(edge_L, edge_router_L, host_count)
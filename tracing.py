@@ -0,0 +1,158 @@
+import math
+import time
+
+# Per-packet latency tracing. A sampled data packet carries a list of
+# (time, event) stamps, added by Host.udt_send, every Interface put and get
+# and Link.tx_pkt; when the destination host receives it the stamps are
+# turned into latencies and added to histograms:
+#   out_queue  put on an out queue until the link takes it
+#   link       taken by the link until put on the next in queue
+#   in_queue   put on an in queue until the node takes it
+#   router     taken by a router until put on an out queue
+#   hop        one in queue to the next, i.e. one router plus the link after it
+#   end_to_end udt_send until udt_receive
+#
+#   tracing.enable(sample_rate=0.01)
+#   ... run ...
+#   print(tracing.tracer.report())
+#
+# Stamps live on the NetworkPacket object, so traces only survive with
+# NetworkPacket.wire_format = 'object', where the interface queues carry the
+# packets themselves. In the other formats a trace would end at the first
+# interface, when the packet is serialized, so enable refuses them.
+
+# the active Tracer, None when tracing is off
+tracer = None
+
+# segment a packet is in between two consecutive queue stamps; 'tx' stamps
+# fall inside a link segment and are skipped
+segment_D = {('put_out', 'get_out'): 'out_queue',
+             ('get_out', 'put_in'): 'link',
+             ('put_in', 'get_in'): 'in_queue',
+             ('get_in', 'put_out'): 'router'}
+
+
+# histogram of durations in logarithmic buckets, eight per power of two
+# (about 9% apart), so it stays the same size however long it runs
+class Histogram:
+    buckets_per_octave = 8
+    # smallest duration told apart, in seconds
+    resolution = 1e-9
+
+    def __init__(self):
+        self.bucket_D = {}  # {bucket: count}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        if duration <= self.resolution:
+            bucket = 0
+        else:
+            bucket = 1 + int(math.log2(duration / self.resolution) * self.buckets_per_octave)
+        self.bucket_D[bucket] = self.bucket_D.get(bucket, 0) + 1
+
+    # @param fraction: e.g. 0.99 for the 99th percentile
+    # @return upper bound of the bucket holding the percentile, at most max
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.bucket_D):
+            seen += self.bucket_D[bucket]
+            if seen >= rank:
+                bound = self.resolution * 2 ** (bucket / self.buckets_per_octave)
+                return min(bound, self.max)
+        return self.max
+
+    # @return {'count', 'mean', 'p50', 'p99', 'max'}, durations in seconds
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else None,
+                'p50': self.percentile(0.5), 'p99': self.percentile(0.99),
+                'max': self.max if self.count else None}
+
+
+class Tracer:
+
+    # @param sample_rate: fraction of the packets sent that get traced
+    # @param clock: time source, e.g. a Simulator's clock for virtual time
+    def __init__(self, sample_rate=1.0, clock=time.perf_counter):
+        if not 0 < sample_rate <= 1:
+            raise Exception('Tracer: sample_rate must be in (0, 1]: %s' % sample_rate)
+        # trace every interval-th packet; counting is cheaper than drawing
+        # random numbers and keeps runs repeatable
+        self.interval = max(1, round(1 / sample_rate))
+        self.countdown = 1
+        self.clock = clock
+        self.hist_D = {name: Histogram() for name in
+                       ('out_queue', 'link', 'in_queue', 'router', 'hop', 'end_to_end')}
+        self.traced = 0  # packets traced to their destination
+
+    # called when printing the object
+    def __str__(self):
+        return 'Tracer'
+
+    # called by Host.udt_send for every data packet
+    def start(self, p):
+        self.countdown -= 1
+        if self.countdown:
+            return
+        self.countdown = self.interval
+        p.trace_L = [(self.clock(), 'send')]
+
+    # record an event on a packet if it is traced
+    def stamp(self, p, event_S):
+        trace_L = getattr(p, 'trace_L', None)
+        if trace_L is not None:
+            trace_L.append((self.clock(), event_S))
+
+    # called by Host.udt_receive: turn the stamps into latencies
+    def finish(self, p):
+        trace_L = getattr(p, 'trace_L', None)
+        if trace_L is None:
+            return
+        p.trace_L = None
+        now = self.clock()
+        self.traced += 1
+        self.hist_D['end_to_end'].add(now - trace_L[0][0])
+        last_in = None
+        trace_L = [stamp for stamp in trace_L if stamp[1] != 'tx']
+        for (t_1, event_1), (t_2, event_2) in zip(trace_L, trace_L[1:]):
+            segment = segment_D.get((event_1, event_2))
+            if segment is not None:
+                self.hist_D[segment].add(t_2 - t_1)
+        for t, event_S in trace_L:
+            if event_S == 'put_in':
+                if last_in is not None:
+                    self.hist_D['hop'].add(t - last_in)
+                last_in = t
+
+    # @return {histogram name: summary}, see Histogram.summary
+    def report(self):
+        report_D = {name: hist.summary() for name, hist in self.hist_D.items()}
+        report_D['traced'] = self.traced
+        return report_D
+
+
+# turn tracing on with a new Tracer; the packets must already be carried
+# as objects, see above
+# @return the Tracer
+def enable(sample_rate=1.0, clock=time.perf_counter):
+    global tracer
+    import network_3  # it imports this module
+    if network_3.NetworkPacket.wire_format != 'object':
+        raise Exception('tracing: traces need NetworkPacket.wire_format = \'object\', not %r' %
+                        network_3.NetworkPacket.wire_format)
+    tracer = Tracer(sample_rate, clock)
+    return tracer
+
+
+def disable():
+    global tracer
+    tracer = None